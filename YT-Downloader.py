@@ -1,26 +1,31 @@
 import os
 import subprocess
 import shutil
+import socket
 import sys
 import asyncio
 import argparse
-import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+import copy
+import contextlib
+import errno
+import sqlite3
+import json
+import time
+import hashlib
+import random
+import re
+import threading
+import tempfile
+import queue
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from rich.console import Console
-from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
-from rich.panel import Panel
-from rich.table import Table
-import yt_dlp
-import readline  
-try:
-    import ttkbootstrap as tbs
-    from ttkbootstrap.tooltip import ToolTip
-    USE_TTKBOOTSTRAP = True
-except ImportError:
-    console = Console()
-    console.print("[yellow][!] ttkbootstrap not found. Falling back to standard tkinter.[/yellow]")
-    USE_TTKBOOTSTRAP = False
+
+# tkinter/ttkbootstrap, yt_dlp, readline and the heavier rich renderables are imported where
+# they are used, so headless runs don't pay for the GUI toolkit or the extractor registry
+USE_TTKBOOTSTRAP = False
 
 # Initialize rich console
 console = Console()
@@ -28,13 +33,111 @@ console = Console()
 # Cache for dependency checks
 DEPENDENCY_CACHE = {}
 
+# Dependency check results persisted across launches, reused while the fingerprint matches
+DEPENDENCY_CACHE_FILE = ".deps_cache.json"
+
+# Import the GUI toolkit on first use; ttkbootstrap is optional
+def load_gui_toolkit():
+    global tk, ttk, messagebox, filedialog, tbs, ToolTip, USE_TTKBOOTSTRAP
+    import tkinter as tk
+    from tkinter import ttk, messagebox, filedialog
+    try:
+        import ttkbootstrap as tbs
+        from ttkbootstrap.tooltip import ToolTip
+        USE_TTKBOOTSTRAP = True
+    except ImportError:
+        console.print("[yellow][!] ttkbootstrap not found. Falling back to standard tkinter.[/yellow]")
+        USE_TTKBOOTSTRAP = False
+
+# Identify the environment the cached checks were made in: same interpreter, same PATH
+def dependency_fingerprint():
+    key = "\0".join([sys.executable, sys.version, os.environ.get('PATH', '')])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+# Seed DEPENDENCY_CACHE from the last launch if nothing relevant changed
+def load_dependency_cache(path=DEPENDENCY_CACHE_FILE):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if data.get('fingerprint') != dependency_fingerprint():
+        return False
+    DEPENDENCY_CACHE.update({name: True for name, found in data.get('found', {}).items() if found})
+    return True
+
+# Persist the positive results; missing tools are re-checked next time
+def save_dependency_cache(path=DEPENDENCY_CACHE_FILE):
+    found = {name: True for name, ok in DEPENDENCY_CACHE.items() if ok}
+    try:
+        with open(path, 'w') as f:
+            json.dump({'fingerprint': dependency_fingerprint(), 'found': found}, f)
+    except OSError:
+        pass
+
+# Index of finished downloads, used by --sync to skip what is already on disk
+INDEX_DB = "download_index.db"
+
+# Browser cookies are decrypted once and then reused for this many seconds (cookie_ttl)
+DEFAULT_COOKIE_TTL = 3600
+
+# Cookie jars already loaded by this process, by browser: {'jar', 'loaded_at'}
+COOKIE_JARS = {}
+
+# Guards the user counts of HTTP handlers shared between YoutubeDL instances (share_session)
+SESSION_LOCK = threading.Lock()
+
+# Durable job queue for --serve mode
+JOBS_DB = "jobs.db"
+
+# Default listen address for --serve; keep it on loopback, the API has no authentication
+DEFAULT_LISTEN = "127.0.0.1:8780"
+
+# Downloads, merges and transcodes happen in this subdirectory of the output directory; finished
+# files are renamed into place, so the output directory never holds partial files
+STAGING_DIR = ".ytd-staging"
+
+# Free space every run leaves untouched on the output volume (min_free_space in config.ini)
+DEFAULT_MIN_FREE_SPACE = "1G"
+
+# Content-addressed store of finished files, shared by every output directory (store_dir in config.ini)
+STORE_DIR = ".media_store"
+
+# On-disk cache of extract_info results (see the *_cache_* keys in config.ini)
+METADATA_CACHE_DIR = ".metadata_cache"
+
+# Playlist listings longer than this aren't cached (playlist_cache_max_entries): collecting them
+# would make memory grow with the playlist while it streams
+DEFAULT_PLAYLIST_CACHE_MAX_ENTRIES = 5000
+
+# Download engines: 'inprocess' reuses extracted info dicts, 'subprocess' spawns yt-dlp per video
+ENGINES = ['inprocess', 'subprocess']
+
+# Connection defaults: per download (fragments or ranges in flight), and across all downloads
+DEFAULT_CONNECTIONS = 4
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_CHUNK_SIZE = "10M"
+
+# 'native' lets yt-dlp fetch plain HTTP formats itself (chunked, one connection); 'aria2c' splits
+# them into parallel range requests when aria2c is installed
+RANGE_DOWNLOADERS = ['native', 'aria2c']
+
+# Throttling defaults: download starts per second per host (and burst), attempts per video
+DEFAULT_REQUESTS_PER_SECOND = 2.0
+DEFAULT_BURST = 4
+DEFAULT_RETRIES = 3
+
+# Upstream responses that mean "slow down" rather than "this video is broken"
+THROTTLE_STATUSES = (403, 429)
+THROTTLE_PATTERN = re.compile(r"HTTP Error (403|429)|Too Many Requests|confirm you.re not a bot", re.IGNORECASE)
+
 # Check for required external tools
-def check_and_install(package_name, install_cmd, pip_package=False):
+def check_and_install(package_name, install_cmd, pip_package=False, interactive=True, optional=False):
     if package_name in DEPENDENCY_CACHE:
         return DEPENDENCY_CACHE[package_name]
     found = False
     if pip_package:
-        found = is_module_installed(package_name)
+        found = is_module_installed(package_name.replace('-', '_'))
     else:
         found = shutil.which(package_name) is not None
         if not found and (hasattr(sys, 'real_prefix') or (hasattr(sys, 'base_prefix') and sys.base_prefix != sys.prefix)):
@@ -42,6 +145,12 @@ def check_and_install(package_name, install_cmd, pip_package=False):
             found = os.path.exists(os.path.join(venv_bin, package_name)) or os.path.exists(os.path.join(venv_bin, f"{package_name}.exe"))
     if not found:
         console.print(f"[red][!] {package_name} not found.[/red]")
+        if not interactive:
+            if optional:
+                console.print(f"[yellow][!] Continuing without {package_name} (non-interactive mode).[/yellow]")
+                return False
+            console.print(f"[red][-] {package_name} is required. Install it with: {install_cmd}[/red]")
+            sys.exit(1)
         choice = input(f"Do you want to install {package_name}? (y/n): ").lower()
         if choice == 'y':
             console.print(f"[yellow][+] Installing {package_name}...[/yellow]")
@@ -77,6 +186,7 @@ def is_module_installed(module_name):
 
 # Setup tab completion for CLI
 def setup_tab_completion():
+    import readline
     options = ['1', '2', '3', '4', '5']
     def complete(text, state):
         matches = [opt for opt in options if opt.startswith(text)]
@@ -103,6 +213,7 @@ def normalize_output_path(path, download_type):
 
 # Show banner with a professional look
 def banner():
+    from rich.panel import Panel
     console.print(Panel.fit("""
 ██╗   ██╗████████╗        ████████╗ ██████╗         ███╗   ███╗██████╗ ██████╗        
 ╚██╗ ██╔╝╚══██╔══╝        ╚══██╔══╝██╔═══██╗        ████╗ ████║██╔══██╗╚════██╗       
@@ -125,6 +236,7 @@ def banner():
 
 # CLI Menu
 async def cli_menu():
+    from rich.table import Table
     setup_tab_completion()
     while True:
         banner()
@@ -177,14 +289,78 @@ async def cli_menu():
         else:
             console.print("[red]⚠️ Invalid choice. Try again.[/red]\n")
 
+# Run an asyncio event loop on a daemon thread, so the Tk main loop never blocks on downloads
+def start_background_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+# Runs GUI download jobs one at a time on a background loop. Progress is posted to a
+# thread-safe queue as (job_id, status, text) tuples for the Tk thread to poll.
+class GuiJobRunner:
+    def __init__(self, updates):
+        self.updates = updates
+        self.loop = start_background_loop()
+        self.jobs = {}
+        self.next_job = 0
+        self.lock = None
+
+    def submit(self, url, is_playlist, output_path, **options):
+        job_id = f"job{self.next_job}"
+        self.next_job += 1
+        tracker = ProgressTracker()
+        future = asyncio.run_coroutine_threadsafe(self._run(job_id, tracker, url, is_playlist, output_path, options), self.loop)
+        self.jobs[job_id] = (future, tracker)
+        return job_id
+
+    def cancel(self, job_id):
+        future, tracker = self.jobs.get(job_id, (None, None))
+        if future and not future.done():
+            tracker.cancel()
+            future.cancel()
+
+    async def _run(self, job_id, tracker, url, is_playlist, output_path, options):
+        # Created lazily so the lock belongs to the background loop; asyncio.Lock wakes waiters in FIFO order
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        try:
+            async with self.lock:
+                self.updates.put((job_id, "Running", "Preparing..."))
+                reporter = asyncio.ensure_future(self._report(job_id, tracker))
+                try:
+                    results = await download_media(url, is_playlist, output_path, tracker=tracker, dashboard=False, **options)
+                finally:
+                    reporter.cancel()
+        except asyncio.CancelledError:
+            # Posted here rather than by cancel(), so no progress update from the reporter can follow it
+            self.updates.put((job_id, "Cancelled", ""))
+            raise
+        if results is None:
+            self.updates.put((job_id, "Failed", "Error during extraction"))
+            return
+        succeeded = sum(1 for result in results if result['success'])
+        self.updates.put((job_id, "Done" if succeeded == len(results) else "Failed", f"{succeeded}/{len(results)} successful"))
+
+    # Summarize the job's tracker at the dashboard refresh rate
+    async def _report(self, job_id, tracker):
+        while True:
+            await asyncio.sleep(1 / PROGRESS_REFRESH_PER_SECOND)
+            snap = tracker.snapshot()
+            finished = sum(snap['counts'].values())
+            current = ""
+            if snap['jobs'] and snap['jobs'][0]['total']:
+                current = f", current {snap['jobs'][0]['downloaded'] * 100 // snap['jobs'][0]['total']}%"
+            self.updates.put((job_id, "Running", f"{finished}/{snap['total'] or '?'} items{current}, {format_bytes(snap['speed'])}/s"))
+
 # GUI Interface
 def gui_main():
+    load_gui_toolkit()
     if USE_TTKBOOTSTRAP:
         root = tbs.Window(themename="flatly")
     else:
         root = tk.Tk()
     root.title("YouTube to MP3 or Video Downloader")
-    root.geometry("800x600")
+    root.geometry("800x860")
     root.resizable(False, False)
 
     # Styling
@@ -312,6 +488,10 @@ def gui_main():
         status_label = ttk.Label(frame, text="Ready", foreground="blue", font=("Helvetica", 12))
     status_label.grid(row=7, column=0, columnspan=2, pady=15)
 
+    # Downloads run on a background event loop; the Tk thread only polls `updates`
+    updates = queue.Queue()
+    runner = GuiJobRunner(updates)
+
     # Download button
     def start_download():
         url = url_entry.get().strip()
@@ -322,10 +502,9 @@ def gui_main():
         if not url:
             messagebox.showerror("Error", "Please enter a YouTube URL")
             return
-        status_label.config(text="Downloading...", **({'bootstyle': "warning"} if USE_TTKBOOTSTRAP else {'foreground': "orange"}))
-        root.update()
-        asyncio.run(download_media(url, is_playlist, output_path, download_type=download_type, quality=quality, status_label=status_label))
-        status_label.config(text="Download Complete!", **({'bootstyle': "success"} if USE_TTKBOOTSTRAP else {'foreground': "green"}))
+        job_id = runner.submit(url, is_playlist, output_path, download_type=download_type, quality=quality)
+        jobs_view.insert("", tk.END, iid=job_id, values=(url, download_type.upper(), "Queued", ""))
+        status_label.config(text=f"Queued {url}", **({'bootstyle': "info"} if USE_TTKBOOTSTRAP else {'foreground': "blue"}))
 
     if USE_TTKBOOTSTRAP:
         tbs.Button(frame, text="Download", command=start_download, bootstyle="success-outline").grid(row=8, column=0, columnspan=2, pady=15, sticky="ew")
@@ -336,19 +515,57 @@ def gui_main():
 
     # Exit button
     if USE_TTKBOOTSTRAP:
-        tbs.Button(frame, text="Exit", command=root.quit, bootstyle="danger-outline").grid(row=9, column=0, columnspan=2, pady=10, sticky="ew")
+        tbs.Button(frame, text="Exit", command=root.quit, bootstyle="danger-outline").grid(row=11, column=0, columnspan=2, pady=10, sticky="ew")
         if USE_TTKBOOTSTRAP:
             ToolTip(frame.children['!button3'], "Close the application")
     else:
-        ttk.Button(frame, text="Exit", command=root.quit).grid(row=9, column=0, columnspan=2, pady=10, sticky="ew")
+        ttk.Button(frame, text="Exit", command=root.quit).grid(row=11, column=0, columnspan=2, pady=10, sticky="ew")
+
+    # Job list: queued, running and finished downloads with per-job progress
+    jobs_view = ttk.Treeview(frame, columns=("url", "type", "status", "progress"), show="headings", height=6)
+    for column, heading, width in (("url", "URL", 330), ("type", "Type", 60), ("status", "Status", 90), ("progress", "Progress", 220)):
+        jobs_view.heading(column, text=heading)
+        jobs_view.column(column, width=width, stretch=column == "url")
+    jobs_view.grid(row=9, column=0, columnspan=2, pady=5, sticky="nsew")
+
+    def cancel_selected():
+        for job_id in jobs_view.selection():
+            runner.cancel(job_id)
+
+    if USE_TTKBOOTSTRAP:
+        cancel_button = tbs.Button(frame, text="Cancel Selected", command=cancel_selected, bootstyle="warning-outline")
+        ToolTip(cancel_button, "Cancel the selected queued or running downloads")
+    else:
+        cancel_button = ttk.Button(frame, text="Cancel Selected", command=cancel_selected)
+    cancel_button.grid(row=10, column=0, columnspan=2, pady=5, sticky="ew")
+
+    # Drain background updates on the Tk thread
+    def poll_updates():
+        while True:
+            try:
+                job_id, status, text = updates.get_nowait()
+            except queue.Empty:
+                break
+            if not jobs_view.exists(job_id):
+                continue
+            jobs_view.set(job_id, "status", status)
+            jobs_view.set(job_id, "progress", text)
+            if status in ("Done", "Failed", "Cancelled"):
+                styles = {'Done': ("success", "green"), 'Failed': ("danger", "red"), 'Cancelled': ("secondary", "gray")}[status]
+                status_label.config(text=f"{status}: {jobs_view.set(job_id, 'url')}", **({'bootstyle': styles[0]} if USE_TTKBOOTSTRAP else {'foreground': styles[1]}))
+        root.after(int(1000 / PROGRESS_REFRESH_PER_SECOND), poll_updates)
+
+    poll_updates()
 
     # Configure grid weights for responsiveness
     frame.columnconfigure(1, weight=1)
+    frame.rowconfigure(9, weight=1)
 
     root.mainloop()
 
 # Configure settings
 def configure_settings():
+    from rich.panel import Panel
     console.print(Panel.fit("[bold yellow]⚙️ Settings Configuration[/bold yellow]", border_style="yellow"))
     default_quality = console.input("[bold green]🎚️ Set default audio quality (e.g., best, 192k, 128k, 64k): [/bold green]").strip() or "best"
     default_video_quality = console.input("[bold green]🎚️ Set default video quality (e.g., 4K, 2K, 1080p, 720p, 480p, 360p, 144p): [/bold green]").strip() or "best"
@@ -360,159 +577,2784 @@ def configure_settings():
     except ValueError:
         console.print("[red]⚠️ Invalid number. Using default (3).[/red]")
         max_parallel = 3
-    with open("config.ini", "w") as f:
-        f.write(f"[Settings]\ndefault_quality={default_quality}\ndefault_video_quality={default_video_quality}\nmax_parallel={max_parallel}")
+    engine = console.input("[bold green]⚙️ Set download engine (inprocess, subprocess) [default: inprocess]: [/bold green]").strip() or "inprocess"
+    if engine not in ENGINES:
+        console.print("[red]⚠️ Invalid engine. Using default (inprocess).[/red]")
+        engine = "inprocess"
+    config = load_config()
+    config.update({
+        'default_quality': default_quality,
+        'default_video_quality': default_video_quality,
+        'max_parallel': max_parallel,
+        'engine': engine,
+    })
+    save_config(config)
     console.print("[green]✅ Settings saved![/green]")
 
-# Load settings
-def load_settings():
-    default_quality = "best"
-    default_video_quality = "best"
-    max_parallel = 3
+# Read every key=value pair from config.ini
+def load_config():
+    config = {}
     if os.path.exists("config.ini"):
         with open("config.ini", "r") as f:
-            lines = f.readlines()
-            for line in lines:
-                if "default_quality=" in line:
-                    default_quality = line.split("=")[1].strip()
-                if "default_video_quality=" in line:
-                    default_video_quality = line.split("=")[1].strip()
-                if "max_parallel=" in line:
-                    max_parallel = int(line.split("=")[1].strip())
+            for line in f:
+                if "=" in line:
+                    key, value = line.split("=", 1)
+                    config[key.strip()] = value.strip()
+    return config
+
+# Write settings back to config.ini, keeping keys set elsewhere
+def save_config(config):
+    with open("config.ini", "w") as f:
+        f.write("[Settings]\n" + "\n".join(f"{key}={value}" for key, value in config.items()))
+
+# Load settings
+def load_settings():
+    config = load_config()
+    default_quality = config.get('default_quality', "best")
+    default_video_quality = config.get('default_video_quality', "best")
+    max_parallel = int(config.get('max_parallel', 3))
     return default_quality, default_video_quality, max_parallel
 
-# Download with rich progress
-async def download_with_progress(command, output_path, video_info, download_type, retries=3, status_label=None):
+# Dashboard and GUI status refresh rate; progress events arrive far more often than this
+PROGRESS_REFRESH_PER_SECOND = 4
+
+# Format a byte count for display
+def format_bytes(count):
+    if count is None:
+        return "?"
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(count) < 1024 or unit == 'GiB':
+            return f"{count:.1f} {unit}" if unit != 'B' else f"{int(count)} B"
+        count /= 1024
+
+# Collects structured progress events (bytes, total, speed, ETA, stage) from every job.
+# emit() only records state under a lock, so it is cheap from any thread; renderers take
+# snapshots at their own fixed rate, so a fast download never drives extra redraws.
+class ProgressTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.stages = {}
+        self.counts = {'done': 0, 'failed': 0, 'skipped': 0}
+        self.finished_bytes = 0
+        self.next_job = 0
+        self.total = None
+        self.cancelled = False
+        self.started = time.monotonic()
+        self.first_byte_at = None
+
+    def add_job(self, title):
+        with self.lock:
+            job = self.next_job
+            self.next_job += 1
+            self.jobs[job] = {'title': title, 'stage': 'queued', 'attempt': 1, 'downloaded': 0, 'total': None, 'speed': None, 'eta': None, 'note': None}
+        return job
+
+    def emit(self, job, **fields):
+        with self.lock:
+            if job in self.jobs:
+                self.jobs[job].update(fields)
+            if self.first_byte_at is None and fields.get('downloaded'):
+                self.first_byte_at = time.monotonic()
+
+    def finish(self, job, status):
+        with self.lock:
+            state = self.jobs.pop(job, None)
+            if state:
+                self.finished_bytes += state['downloaded'] or 0
+            self.counts[status] += 1
+
+    def set_total(self, total):
+        self.total = total
+
+    # Ask running downloads to stop; checked from yt-dlp progress hooks
+    def cancel(self):
+        self.cancelled = True
+
+    # Queue depth and activity for a pipeline stage such as 'download' or 'transcode'
+    def set_stage(self, name, active, queued):
+        with self.lock:
+            self.stages[name] = (active, queued)
+
+    def snapshot(self):
+        with self.lock:
+            jobs = [dict(state) for state in self.jobs.values()]
+            stages = dict(self.stages)
+            counts = dict(self.counts)
+            finished_bytes = self.finished_bytes
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        total_bytes = finished_bytes + sum(state['downloaded'] for state in jobs)
+        return {
+            'jobs': jobs,
+            'stages': stages,
+            'counts': counts,
+            'speed': sum(state['speed'] or 0 for state in jobs if state['stage'] == 'download'),
+            'bytes': total_bytes,
+            'average_speed': total_bytes / elapsed,
+            'total': self.total,
+        }
+
+# Histogram bucket bounds (seconds) for stage and per-item timings
+METRIC_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Stage timings and counters for a run (or, in --serve mode, for the daemon's lifetime).
+# Stages: extract (enumerating URLs and playlists), resolve, download (per attempt),
+# retry_wait (backoff sleeps), loudness (measuring pass), transcode, remux (passthrough copies), link (media store)
+# and item (end to end).
+# With a parent, everything recorded is also added to the parent (a daemon job feeding the daemon's totals).
+class RunMetrics:
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.samples = {}
+        self.counters = {'bytes': 0, 'retries': 0}
+        self.items = {}
+        self.throttled = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+        if self.parent:
+            self.parent.observe(stage, seconds)
+
+    # Time a block: `with metrics.span('transcode'):`
+    @contextlib.contextmanager
+    def span(self, stage):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - started)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        if self.parent:
+            self.parent.count(name, amount)
+
+    def item(self, status, seconds, size):
+        with self.lock:
+            self.items[status] = self.items.get(status, 0) + 1
+            self.counters['bytes'] += size
+            self.samples.setdefault('item', []).append(seconds)
+        if self.parent:
+            self.parent.item(status, seconds, size)
+
+    def throttle(self, status):
+        with self.lock:
+            self.throttled[str(status)] = self.throttled.get(str(status), 0) + 1
+        if self.parent:
+            self.parent.throttle(status)
+
+    # JSON-friendly totals and percentiles per stage
+    def summary(self):
+        with self.lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+            counters, items, throttled = dict(self.counters), dict(self.items), dict(self.throttled)
+        stages = {}
+        for stage, values in samples.items():
+            stages[stage] = {
+                'count': len(values),
+                'total_seconds': round(sum(values), 3),
+                'mean_seconds': round(sum(values) / len(values), 3),
+                'p50_seconds': round(values[len(values) // 2], 3),
+                'p95_seconds': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+                'max_seconds': round(values[-1], 3),
+            }
+        return {
+            'started_at': self.started_at,
+            'wall_seconds': round(time.monotonic() - self.started, 3),
+            'items': items,
+            'bytes': counters.pop('bytes'),
+            'retries': counters.pop('retries'),
+            'throttled': throttled,
+            'counters': counters,
+            'stages': stages,
+        }
+
+    # Prometheus text exposition format
+    def prometheus(self):
+        with self.lock:
+            samples = {stage: list(values) for stage, values in self.samples.items()}
+            counters, items, throttled = dict(self.counters), dict(self.items), dict(self.throttled)
+        lines = [
+            "# HELP ytd_stage_duration_seconds Time spent per stage (extract, resolve, download, retry_wait, loudness, transcode, remux, link, item)",
+            "# TYPE ytd_stage_duration_seconds histogram",
+        ]
+        for stage, values in sorted(samples.items()):
+            for bound in METRIC_BUCKETS:
+                lines.append(f'ytd_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {sum(1 for value in values if value <= bound)}')
+            lines.append(f'ytd_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {len(values)}')
+            lines.append(f'ytd_stage_duration_seconds_sum{{stage="{stage}"}} {sum(values):.6f}')
+            lines.append(f'ytd_stage_duration_seconds_count{{stage="{stage}"}} {len(values)}')
+        lines += ["# HELP ytd_items_total Finished items by status", "# TYPE ytd_items_total counter"]
+        lines += [f'ytd_items_total{{status="{status}"}} {count}' for status, count in sorted(items.items())]
+        lines += ["# HELP ytd_throttled_total Throttling responses from upstream by HTTP status", "# TYPE ytd_throttled_total counter"]
+        lines += [f'ytd_throttled_total{{status="{status}"}} {count}' for status, count in sorted(throttled.items())]
+        for name, value in sorted(counters.items()):
+            lines += [f"# TYPE ytd_{name}_total counter", f"ytd_{name}_total {value}"]
+        lines += ["# TYPE ytd_uptime_seconds gauge", f"ytd_uptime_seconds {time.monotonic() - self.started:.3f}"]
+        return "\n".join(lines) + "\n"
+
+# Wrap an entry iterator so the time spent producing each entry (extraction, playlist paging)
+# is recorded as the 'extract' stage
+def timed_entries(entries, metrics):
+    iterator = iter(entries)
+    while True:
+        started = time.monotonic()
+        try:
+            entry = next(iterator)
+        except StopIteration:
+            metrics.observe('extract', time.monotonic() - started)
+            return
+        metrics.observe('extract', time.monotonic() - started)
+        yield entry
+
+# Write a file atomically so scrapers never read half of it
+def write_text_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# One live table for all concurrent jobs plus a total throughput line, rendered by rich.Live
+class ProgressDashboard:
+    def __init__(self, tracker, max_rows=15):
+        self.tracker = tracker
+        self.max_rows = max_rows
+
+    def __rich__(self):
+        from rich.console import Group
+        from rich.progress_bar import ProgressBar
+        from rich.table import Table
+        snap = self.tracker.snapshot()
+        table = Table(border_style="cyan", expand=True)
+        table.add_column("Title", ratio=3, no_wrap=True)
+        table.add_column("Stage")
+        table.add_column("Progress", ratio=2)
+        table.add_column("Size", justify="right")
+        table.add_column("Speed", justify="right")
+        table.add_column("ETA", justify="right")
+        for state in snap['jobs'][:self.max_rows]:
+            total = state['total']
+            bar = ProgressBar(total=total or 100, completed=state['downloaded'] if total else 0, pulse=not total)
+            stage = state['stage'] if state['attempt'] == 1 else f"{state['stage']} (try {state['attempt']})"
+            table.add_row(
+                f"[red]{state['title']}[/red]" if state['note'] else state['title'],
+                stage,
+                bar,
+                f"{format_bytes(state['downloaded'])}/{format_bytes(total)}",
+                f"{format_bytes(state['speed'])}/s" if state['speed'] else "",
+                f"{int(state['eta'])}s" if state['eta'] is not None else "",
+            )
+        stages = " | ".join(f"{name}: {active} active, {queued} queued" for name, (active, queued) in snap['stages'].items())
+        counts = snap['counts']
+        skipped = f", {counts['skipped']} skipped" if counts['skipped'] else ""
+        summary = (
+            f"[bold]Total:[/bold] {len(snap['jobs'])} active, {counts['done']} done, {counts['failed']} failed{skipped}"
+            f" | {format_bytes(snap['speed'])}/s now, {format_bytes(snap['average_speed'])}/s average, {format_bytes(snap['bytes'])} transferred"
+        )
+        return Group(table, summary, f"[magenta]{stages}[/magenta]") if stages else Group(table, summary)
+
+# Structured progress for the subprocess engine: one machine-readable line per update
+PROGRESS_TEMPLATE = "download:[progress] %(progress.downloaded_bytes)s %(progress.total_bytes)s %(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s"
+
+# Parse a --progress-template line into progress fields ('NA' means unknown)
+def parse_progress_line(line):
+    values = [None if value == 'NA' else float(value) for value in line.split()[1:6]]
+    downloaded, total, estimate, speed, eta = values + [None] * (5 - len(values))
+    return {'downloaded': downloaded or 0, 'total': total or estimate, 'speed': speed, 'eta': eta}
+
+# Exponential backoff with full jitter, so retries from parallel workers don't line up
+def backoff_delay(attempt, base=2.0, cap=120.0):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# The HTTP status behind a throttling failure (403/429), or None for any other error.
+# yt-dlp wraps the HTTPError in DownloadError.exc_info; the message is the fallback.
+def throttle_status(error):
+    seen = set()
+    current = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        status = getattr(current, 'status', None) or getattr(current, 'code', None)
+        if status in THROTTLE_STATUSES:
+            return status
+        exc_info = getattr(current, 'exc_info', None)
+        current = (exc_info[1] if exc_info else None) or current.__cause__ or current.__context__
+    return throttle_status_from_text(str(error))
+
+# Classify an error message (yt-dlp output or exception text) the same way
+def throttle_status_from_text(text):
+    match = THROTTLE_PATTERN.search(text)
+    if not match:
+        return None
+    return int(match.group(1)) if match.group(1) else 429
+
+# Shared throttle for one run: a token bucket per host for download starts, plus an AIMD
+# concurrency limit with a circuit breaker. A 403/429 halves the limit, halves that host's
+# rate and pauses new starts for a cooldown that doubles while errors keep coming. Each
+# success adds back 1/limit (about one slot per limit-many successes) and 10% of the rate.
+class AdaptiveThrottle:
+    def __init__(self, max_concurrency=None, rate=None, burst=DEFAULT_BURST, cooldown=15.0, max_cooldown=300.0):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency) if max_concurrency else None
+        self.base_rate = rate
+        self.burst = burst
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.active = 0
+        self.buckets = {}
+        self.open_until = 0.0
+        self.trips = 0
+        self.throttled = 0
+        self.condition = asyncio.Condition()
+
+    # Seconds until `host` has a token, taking it if one is there now
+    def _take_token(self, host, now):
+        if not self.base_rate:
+            return 0
+        bucket = self.buckets.setdefault(host, {'tokens': float(self.burst), 'rate': self.base_rate, 'updated': now})
+        bucket['tokens'] = min(self.burst, bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+        bucket['updated'] = now
+        if bucket['tokens'] >= 1:
+            bucket['tokens'] -= 1
+            return 0
+        return (1 - bucket['tokens']) / bucket['rate']
+
+    # Wait for a free slot under the current limit, a closed circuit and a token for `host`.
+    # With slot=False (requests bounded elsewhere, such as format resolution) only the circuit
+    # and the token are waited for, and there is nothing to release afterwards.
+    async def acquire(self, host, slot=True):
+        while True:
+            async with self.condition:
+                now = time.monotonic()
+                if now < self.open_until:
+                    wait = self.open_until - now
+                elif slot and self.limit is not None and self.active >= int(self.limit):
+                    # Woken by release(); waits for a time are slept out below
+                    await self.condition.wait()
+                    continue
+                else:
+                    wait = self._take_token(host, now)
+                    if not wait:
+                        if slot:
+                            self.active += 1
+                        return
+            # Outside the lock: wait_for around condition.wait() can hand the lock back released
+            # when the waiting task is cancelled at the wrong moment
+            await asyncio.sleep(wait)
+
+    # Give the slot back; outcome is 'ok', 'throttled', or anything else for ordinary failures
+    async def release(self, host, outcome, status=None):
+        async with self.condition:
+            self.active -= 1
+            if outcome == 'throttled':
+                self._on_throttle(host, status)
+            elif outcome == 'ok':
+                self._on_success(host)
+            self.condition.notify_all()
+
+    # Count a throttling error that happened outside a download slot (e.g. while resolving)
+    async def report_throttle(self, host, status):
+        async with self.condition:
+            self._on_throttle(host, status)
+            self.condition.notify_all()
+
+    def _on_throttle(self, host, status):
+        self.throttled += 1
+        now = time.monotonic()
+        # One burst of errors from jobs that were already in flight counts as a single trip
+        if now < self.open_until:
+            return
+        self.trips += 1
+        pause = min(self.max_cooldown, self.cooldown * 2 ** (self.trips - 1)) * random.uniform(1, 1.5)
+        self.open_until = now + pause
+        bucket = self.buckets.get(host)
+        if bucket:
+            bucket['rate'] = max(self.base_rate / 32, bucket['rate'] / 2)
+        if self.limit is not None:
+            self.limit = max(1.0, self.limit / 2)
+        limit = f", concurrency now {int(self.limit)}" if self.limit is not None else ""
+        console.print(f"[yellow][!] {host} is throttling (HTTP {status or '?'}): pausing new downloads for {pause:.0f}s{limit}[/yellow]")
+
+    def _on_success(self, host):
+        self.trips = 0
+        bucket = self.buckets.get(host)
+        if bucket:
+            bucket['rate'] = min(self.base_rate, bucket['rate'] + self.base_rate / 10)
+        if self.limit is not None and self.limit < self.max_concurrency:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            if self.limit == self.max_concurrency:
+                console.print(f"[green][+] Throttling cleared, back to {self.max_concurrency} parallel download(s)[/green]")
+
+# Host that a video's downloads count against in the throttle
+def throttle_host(video_info):
+    return urlsplit(video_info.get('webpage_url') or video_info.get('url') or '').hostname or 'default'
+
+# Feed yt-dlp's stdout into the tracker and collect the final file paths it prints
+async def read_subprocess_progress(process, tracker, job, filepaths, throttle_statuses=None):
     error_count = 0
+    async for line in process.stdout:
+        line = line.decode().strip()
+        status = throttle_status_from_text(line)
+        if status:
+            error_count += 1
+            if throttle_statuses is not None:
+                throttle_statuses.append(status)
+            if error_count <= 1:  # Show only the first throttling error
+                tracker.emit(job, note=f"HTTP Error {status}: Possible rate-limiting or restricted content")
+            continue
+        if line.startswith('[progress] '):
+            try:
+                tracker.emit(job, **parse_progress_line(line))
+            except ValueError:
+                pass
+            continue
+        # --print after_move:filepath reports where the finished file landed
+        if os.path.isabs(line) and os.path.exists(line):
+            filepaths.append(line)
+
+# Bytes already in .part files for this title, i.e. what a retry resumes from
+def partial_bytes(output_path, title):
+    prefix = sanitize_filename(title)
+    total = 0
+    with contextlib.suppress(OSError):
+        for name in os.listdir(output_path):
+            if name.startswith(prefix) and name.endswith('.part'):
+                total += os.path.getsize(os.path.join(output_path, name))
+    return total
+
+# Tell the user when a retry picks up a partial download instead of starting over
+def report_resume(output_path, title):
+    resumed = partial_bytes(output_path, title)
+    if resumed:
+        console.print(f"[yellow][+] Resuming {title} from {format_bytes(resumed)}[/yellow]")
+
+# Download with rich progress
+async def download_with_progress(command, output_path, video_info, download_type, retries=DEFAULT_RETRIES, tracker=None, job=None, throttle=None, metrics=None):
+    tracker = tracker or ProgressTracker()
+    throttle = throttle or AdaptiveThrottle()
+    metrics = metrics or RunMetrics()
+    host = throttle_host(video_info)
+    if job is None:
+        job = tracker.add_job(video_info.get('title', 'video'))
+    filepaths = []
     for attempt in range(retries):
+        tracker.emit(job, stage='download', attempt=attempt + 1, downloaded=0, total=None, speed=None, eta=None)
+        if attempt:
+            report_resume(output_path, video_info.get('title', 'video'))
+        throttle_statuses = []
+        outcome = 'error'
+        await throttle.acquire(host)
+        started = time.monotonic()
         try:
             os.makedirs(output_path, exist_ok=True)
-            with Progress(
-                TextColumn("[progress.description]{task.description}"),
-                BarColumn(),
-                TimeRemainingColumn(),
-                console=console
-            ) as progress:
-                task = progress.add_task(f"[green]Downloading {video_info.get('title', 'video')} (Attempt {attempt+1}/{retries})...", total=None)
-                process = await asyncio.create_subprocess_exec(
-                    *command,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.STDOUT
-                )
-                async for line in process.stdout:
-                    line = line.decode().strip()
-                    if "HTTP Error 403: Forbidden" in line:
-                        error_count += 1
-                        if error_count <= 1:  # Show only the first 403 error
-                            progress.update(task, description=f"[red]HTTP Error 403: Possible rate-limiting or restricted content[/red]")
-                        continue
-                    progress.update(task, advance=1, description=line[:80])
-                    if status_label:
-                        status_label.config(text=line[:80], **({'bootstyle': "warning"} if USE_TTKBOOTSTRAP else {'foreground': "orange"}))
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
+            )
+            try:
+                await read_subprocess_progress(process, tracker, job, filepaths, throttle_statuses)
                 await process.wait()
-                if process.returncode == 0:
-                    console.print(f"[green]✅ Downloaded {video_info.get('title', 'video')}[/green]")
-                    return True
-                else:
-                    console.print(f"[red]❌ Failed to download {video_info.get('title', 'video')} (Attempt {attempt+1}/{retries})[/red]")
+            except asyncio.CancelledError:
+                process.kill()
+                outcome = None
+                raise
+            if process.returncode == 0:
+                outcome = 'ok'
+                console.print(f"[green]✅ Downloaded {video_info.get('title', 'video')}[/green]")
+                return {'success': True, 'path': filepaths[-1] if filepaths else None, 'retries': attempt}
+            else:
+                outcome = 'throttled' if throttle_statuses else 'error'
+                console.print(f"[red]❌ Failed to download {video_info.get('title', 'video')} (Attempt {attempt+1}/{retries})[/red]")
         except Exception as e:
             console.print(f"[red]❌ Error on attempt {attempt+1}/{retries}: {e}[/red]")
+        finally:
+            metrics.observe('download', time.monotonic() - started)
+            if throttle_statuses:
+                metrics.throttle(throttle_statuses[-1])
+            await throttle.release(host, outcome, throttle_statuses[-1] if throttle_statuses else None)
         if attempt < retries - 1:
-            await asyncio.sleep(2)
+            metrics.count('retries')
+            with metrics.span('retry_wait'):
+                await asyncio.sleep(backoff_delay(attempt))
     console.print(f"[red]❌ Failed to download {video_info.get('title', 'video')} after {retries} attempts[/red]")
-    if status_label:
-        status_label.config(text=f"Failed to download {video_info.get('title', 'video')}", **({'bootstyle': "danger"} if USE_TTKBOOTSTRAP else {'foreground': "red"}))
-    return False
+    return {'success': False, 'path': None, 'retries': retries - 1}
 
-# Main download function
-async def download_media(url, is_playlist, output_path, download_type, quality, status_label=None):
-    default_quality, default_video_quality, max_parallel = load_settings()
-    if not quality:
-        quality = default_quality if download_type == 'mp3' else default_video_quality
-    
-    console.print(f"\n[yellow][+] Preparing download for {url}...[/yellow]\n")
-    quality_map = {
-        '4K': 'bestvideo[height<=?2160]+bestaudio/best',
-        '2K': 'bestvideo[height<=?1440]+bestaudio/best',
-        '1080p': 'bestvideo[height<=?1080]+bestaudio/best',
-        '720p': 'bestvideo[height<=?720]+bestaudio/best',
-        '480p': 'bestvideo[height<=?480]+bestaudio/best',
-        '360p': 'bestvideo[height<=?360]+bestaudio/best',
-        '144p': 'bestvideo[height<=?144]+bestaudio/best',
+# Route yt-dlp progress hooks to whichever job currently owns this YoutubeDL instance
+def attach_progress_hook(ydl):
+    # Warm instances come back for later runs; they keep the hook they already have
+    hook_state = getattr(ydl, 'progress_hook_state', None)
+    if hook_state is None:
+        hook_state = ydl.progress_hook_state = {'callback': None}
+        def hook(d):
+            if hook_state['callback']:
+                hook_state['callback'](d)
+        ydl.add_progress_hook(hook)
+    return ydl, hook_state
+
+# Download in-process from an already extracted info dict, reusing a long-lived YoutubeDL
+async def download_in_process(worker, output_path, video_info, download_type, retries=DEFAULT_RETRIES, tracker=None, job=None, executor=None, options=None, throttle=None, metrics=None):
+    import yt_dlp
+    ydl, hook_state = worker
+    loop = asyncio.get_running_loop()
+    title = video_info.get('title', 'video')
+    tracker = tracker or ProgressTracker()
+    throttle = throttle or AdaptiveThrottle()
+    metrics = metrics or RunMetrics()
+    host = throttle_host(video_info)
+    if job is None:
+        job = tracker.add_job(title)
+    # Per-job settings such as the connection count; the worker is ours until we return.
+    # YoutubeDL builds its format selector once, in __init__, so a per-job format gets its own
+    # selector, and the worker's own one is put back afterwards.
+    format_selector, ydl_format = ydl.format_selector, ydl.params.get('format')
+    if options:
+        ydl.params.update(options)
+        if options.get('format'):
+            ydl.format_selector = ydl.build_format_selector(options['format'])
+    try:
+        for attempt in range(retries):
+            tracker.emit(job, stage='download', attempt=attempt + 1, downloaded=0, total=None, speed=None, eta=None)
+            if attempt:
+                report_resume(output_path, title)
+
+            # Runs on the executor thread; the tracker only records state, rendering happens elsewhere
+            def on_progress(d):
+                if tracker.cancelled:
+                    raise yt_dlp.utils.DownloadCancelled()
+                if d['status'] == 'downloading':
+                    tracker.emit(job, downloaded=d.get('downloaded_bytes') or 0, total=d.get('total_bytes') or d.get('total_bytes_estimate'), speed=d.get('speed'), eta=d.get('eta'))
+
+            hook_state['callback'] = on_progress
+            outcome, status = 'error', None
+            await throttle.acquire(host)
+            started = time.monotonic()
+            try:
+                os.makedirs(output_path, exist_ok=True)
+                # process_ie_result re-selects formats from the dict in hand without re-extracting
+                result = await loop.run_in_executor(executor, ydl.process_ie_result, copy.deepcopy(video_info), True)
+                outcome = 'ok'
+                console.print(f"[green]✅ Downloaded {title}[/green]")
+                downloads = result.get('requested_downloads') or [{}]
+                # What actually came down, for planning the MP3 stage. yt-dlp drops the fields a
+                # download shares with the result, which holds the selected format's copy of them.
+                downloaded = {key: downloads[-1].get(key, result.get(key)) for key in ('format_id', 'acodec', 'ext')}
+                return {'success': True, 'path': downloads[-1].get('filepath'), 'retries': attempt, 'downloaded_format': downloaded}
+            except yt_dlp.utils.DownloadCancelled:
+                outcome = None
+                raise asyncio.CancelledError()
+            except Exception as e:
+                status = throttle_status(e)
+                outcome = 'throttled' if status else 'error'
+                console.print(f"[red]❌ Error on attempt {attempt+1}/{retries}: {e}[/red]")
+            finally:
+                hook_state['callback'] = None
+                metrics.observe('download', time.monotonic() - started)
+                if status:
+                    metrics.throttle(status)
+                await throttle.release(host, outcome, status)
+            if attempt < retries - 1:
+                metrics.count('retries')
+                with metrics.span('retry_wait'):
+                    await asyncio.sleep(backoff_delay(attempt))
+        console.print(f"[red]❌ Failed to download {title} after {retries} attempts[/red]")
+        return {'success': False, 'path': None, 'retries': retries - 1}
+    finally:
+        ydl.format_selector = format_selector
+        if options and options.get('format'):
+            ydl.params['format'] = ydl_format
+
+# Run download jobs through a bounded worker pool, returning results in input order.
+# `entries` may be a lazy iterator; with `prepare`, each entry's preparation (e.g. format
+# resolution) starts as soon as it is queued so workers never wait on it. The queue bound
+# keeps at most 2 * max_parallel prepared entries in memory.
+async def run_download_pool(entries, worker, max_parallel, prepare=None, executor=None, on_total=None, queue=None):
+    loop = asyncio.get_running_loop()
+    queue = queue or asyncio.Queue(maxsize=max_parallel)
+    results = {}
+    done = object()
+
+    async def produce():
+        iterator = iter(entries)
+        index = 0
+        try:
+            while True:
+                # Lazy playlists fetch pages inside next(), so keep it off the event loop
+                try:
+                    entry = await loop.run_in_executor(executor, next, iterator, done)
+                except Exception as e:
+                    # e.g. a later playlist page failing to load: the entries already queued still
+                    # run, and the rest of the listing shows up as one failed item
+                    console.print(f"[red]❌ Stopped listing entries after {index}: {e}[/red]")
+                    results[index] = {'index': index + 1, 'title': 'Remaining playlist entries', 'success': False, 'path': None, 'error': str(e)}
+                    break
+                if entry is done:
+                    break
+                if entry is None:
+                    continue
+                prepared = asyncio.ensure_future(prepare(index, entry)) if prepare else None
+                await queue.put((index, entry, prepared))
+                index += 1
+        finally:
+            for _ in range(max_parallel):
+                await queue.put(None)
+        if on_total:
+            on_total(index)
+
+    async def worker_loop():
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            index, entry, prepared = job
+            try:
+                results[index] = await worker(index, entry, prepared)
+            except Exception as e:
+                console.print(f"[red]❌ Error: {e}[/red]")
+                results[index] = {'index': index + 1, 'title': entry.get('title', 'Unknown Title'), 'success': False, 'path': None, 'error': str(e)}
+
+    await asyncio.gather(produce(), *(worker_loop() for _ in range(max_parallel)))
+    return [results[index] for index in sorted(results)]
+
+# Audio codecs that passthrough mode keeps as they are, and the audio-only container each is stored in
+PASSTHROUGH_CODECS = {'opus': 'opus', 'mp4a': 'm4a', 'aac': 'm4a', 'mp3': 'mp3'}
+
+# Video heights behind the quality labels
+VIDEO_HEIGHTS = {'4K': 2160, '2K': 1440, '1080p': 1080, '720p': 720, '480p': 480, '360p': 360, '144p': 144}
+
+# Codec family of a format ('opus', 'mp4a', 'mp3', ...), or None when the extractor didn't say
+def audio_codec(fmt):
+    codec = (fmt.get('acodec') or '').split('.')[0].lower()
+    return codec if codec and codec != 'none' else None
+
+# Target bitrate in kbps for an MP3 quality such as '192k'; None for 'best'
+def target_bitrate(quality):
+    digits = str(quality).lower().rstrip('k')
+    return int(digits) if digits.isdigit() else None
+
+# Index of one entry's formats, built once per item: downloadable audio-only formats in the
+# preferred language, and the video heights on offer
+class FormatIndex:
+    def __init__(self, video):
+        formats = [fmt for fmt in video.get('formats') or [] if fmt.get('format_id') and fmt.get('url') and not fmt.get('has_drm')]
+        audio = [fmt for fmt in formats if fmt.get('vcodec') == 'none' and audio_codec(fmt)]
+        # Dubbed tracks rank below the original audio; only the best-ranked language is considered
+        language = max((fmt.get('language_preference') or -1 for fmt in audio), default=-1)
+        self.audio = [fmt for fmt in audio if (fmt.get('language_preference') or -1) == language]
+        self.heights = sorted({fmt['height'] for fmt in formats if fmt.get('height') and fmt.get('vcodec') != 'none'})
+
+    # Cheapest audio-only format that satisfies the quality: the lowest bitrate at or above the
+    # target (smallest file on ties), or the highest bitrate for 'best' or when none reaches it.
+    # With passthrough, codecs that can be kept without re-encoding win whenever one is offered.
+    def pick_audio(self, quality, passthrough=False):
+        candidates = self.audio
+        if passthrough:
+            candidates = [fmt for fmt in candidates if audio_codec(fmt) in PASSTHROUGH_CODECS] or candidates
+        if not candidates:
+            return None
+        bitrate = lambda fmt: fmt.get('abr') or fmt.get('tbr') or 0
+        size = lambda fmt: fmt.get('filesize') or fmt.get('filesize_approx') or float('inf')
+        # Plain HTTP beats HLS/DASH: one request instead of a fragment per few seconds
+        fragmented = lambda fmt: fmt.get('protocol') not in ('http', 'https')
+        target = target_bitrate(quality)
+        enough = [fmt for fmt in candidates if target and bitrate(fmt) >= target]
+        if enough:
+            return min(enough, key=lambda fmt: (bitrate(fmt), fragmented(fmt), size(fmt)))
+        return max(candidates, key=lambda fmt: (bitrate(fmt), not fragmented(fmt), -size(fmt)))
+
+    # Quality label of the tallest video at or below the selected quality
+    def quality_label(self, selected_quality):
+        if selected_quality == 'best':
+            return 'best'
+        selected_height = VIDEO_HEIGHTS.get(selected_quality, 2160)
+        max_height = max((height for height in self.heights if height <= selected_height), default=0)
+        for q, h in VIDEO_HEIGHTS.items():
+            if max_height >= h:
+                return q
+        return '144p'  # Fallback to lowest if no match
+
+# Decide what the MP3 stage does with a downloaded file: ('keep' | 'remux' | 'encode', target ext).
+# 'remux' is a stream copy, which still writes tags (and, into MP3, cover art).
+# `fmt` is the format that was downloaded; when it doesn't name its codec (or on the subprocess
+# engine) the file extension is all there is to go on, and YouTube's audio-only webm is Opus.
+def audio_plan(path, quality, passthrough, fmt=None, post=None):
+    ext = os.path.splitext(path)[1][1:].lower()
+    codec = (audio_codec(fmt) if fmt else None) or {'mp3': 'mp3', 'm4a': 'mp4a', 'opus': 'opus', 'webm': 'opus'}.get(ext)
+    # An MP3 source is already the target; re-encoding it would only lose quality (unless it is normalized)
+    if codec == 'mp3' and (passthrough or quality == 'best') and not (post and post['loudnorm'] is not None):
+        container = 'mp3'
+    elif passthrough and codec in PASSTHROUGH_CODECS:
+        container = PASSTHROUGH_CODECS[codec]
+    else:
+        return 'encode', 'mp3'
+    # A file that gets tags (or, as MP3, cover art) is still copied, not re-encoded
+    if ext == container and not (post and (post['tags'] or (container == 'mp3' and post['cover']))):
+        return 'keep', container
+    return 'remux', container
+
+# Loudness normalization targets besides integrated loudness (loudnorm_target in config.ini):
+# true peak in dBTP and loudness range in LU
+DEFAULT_LOUDNORM_TARGET = -14.0
+LOUDNORM_TRUE_PEAK = -1.5
+LOUDNORM_RANGE = 11
+
+# Settings for the MP3 post-processing pass: tags, cover art and the loudness target (None = off)
+def load_audio_post(config, normalize=None, tags=None):
+    enabled = lambda key, default: config.get(key, default).lower() in ('1', 'true', 'yes', 'on')
+    if tags is None:
+        tags = enabled('embed_metadata', 'true')
+    if normalize is None:
+        normalize = enabled('loudnorm', 'false')
+    return {
+        'tags': tags,
+        'cover': tags and enabled('embed_thumbnail', 'true'),
+        'loudnorm': float(config.get('loudnorm_target', DEFAULT_LOUDNORM_TARGET)) if normalize else None,
+    }
+
+# ID3 tags for a track from its info dict
+def audio_tags(video):
+    tags = {
+        'title': video.get('track') or video.get('title'),
+        'artist': ', '.join(video.get('artists') or []) or video.get('artist') or video.get('creator') or video.get('uploader') or video.get('channel'),
+        'album': video.get('album') or video.get('playlist_title'),
+        'date': (video.get('release_date') or video.get('upload_date') or '')[:4] or video.get('release_year'),
+        'track': video.get('track_number') or video.get('playlist_index'),
+        'comment': video.get('webpage_url'),
+    }
+    return {key: str(value) for key, value in tags.items() if value}
+
+# Fetch a track's thumbnail next to the staged file, for embedding as cover art; None if it has none.
+# JPEG/PNG thumbnails are preferred, since those are embedded without converting them.
+def fetch_cover(ydl, video, path):
+    thumbnails = [thumbnail for thumbnail in video.get('thumbnails') or [] if thumbnail.get('url')]
+    if not thumbnails and video.get('thumbnail'):
+        thumbnails = [{'url': video['thumbnail']}]
+    if not thumbnails:
+        return None
+    # yt-dlp sorts thumbnails from worst to best
+    embeddable = [thumbnail for thumbnail in thumbnails if urlsplit(thumbnail['url']).path.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    url = (embeddable or thumbnails)[-1]['url']
+    cover = os.path.splitext(path)[0] + '.cover' + (os.path.splitext(urlsplit(url).path)[1].lower() or '.jpg')
+    with ydl.urlopen(url) as response, open(cover, 'wb') as f:
+        shutil.copyfileobj(response, f)
+    return cover
+
+# Run ffmpeg, returning its stderr; raises RuntimeError with ffmpeg's last error line on failure
+async def run_ffmpeg(*args):
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-y', '-hide_banner', *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    stderr = stderr.decode(errors='replace')
+    if process.returncode != 0:
+        raise RuntimeError(stderr.strip().splitlines()[-1] if stderr.strip() else f"ffmpeg exited with {process.returncode}")
+    return stderr
+
+# First loudnorm pass: measure integrated loudness, true peak and range. Decodes, but encodes nothing.
+async def measure_loudness(source, target):
+    stderr = await run_ffmpeg('-nostats', '-i', source, '-map', '0:a:0', '-af', f"loudnorm=I={target}:TP={LOUDNORM_TRUE_PEAK}:LRA={LOUDNORM_RANGE}:print_format=json", '-f', 'null', '-')
+    start, end = stderr.rfind('{'), stderr.rfind('}')
+    if start < 0 or end < start:
+        raise RuntimeError("ffmpeg printed no loudness measurement")
+    measured = json.loads(stderr[start:end + 1])
+    return {key: measured[key] for key in ('input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset')}
+
+# Second-pass loudnorm filter from a measurement. Linear mode applies one gain to the whole track;
+# loudnorm works at 192 kHz internally, so the output is resampled for the MP3 encoder.
+def loudnorm_filter(measured, target):
+    return (f"loudnorm=I={target}:TP={LOUDNORM_TRUE_PEAK}:LRA={LOUDNORM_RANGE}:measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}:offset={measured['target_offset']}:linear=true,aresample=44100")
+
+# Write the final audio file in one ffmpeg run: a single decode through the filter graph (loudness)
+# into a single encode, with tags and cover art written by the same muxer. With quality=None the
+# stream is copied instead (passthrough remuxes). The source is replaced on success.
+async def process_audio(source, ext, quality=None, tags=None, cover=None, audio_filter=None):
+    base = os.path.splitext(source)[0]
+    target = f"{base}.{ext}"
+    partial = f"{base}.post.{ext}"
+    args = ['-loglevel', 'error', '-i', source]
+    if cover:
+        args += ['-i', cover]
+    args += ['-map', '0:a:0']
+    if cover:
+        args += [
+            '-map', '1:v:0', '-codec:v', 'copy' if cover.endswith(('.jpg', '.jpeg', '.png')) else 'mjpeg',
+            '-disposition:v', 'attached_pic', '-metadata:s:v', 'title=Album cover', '-metadata:s:v', 'comment=Cover (front)',
+        ]
+    if quality is None:
+        args += ['-codec:a', 'copy']
+    else:
+        if audio_filter:
+            args += ['-af', audio_filter]
+        # Same VBR/CBR mapping yt-dlp's FFmpegExtractAudio uses: 'best' is LAME V0
+        args += ['-codec:a', 'libmp3lame', *(['-q:a', '0'] if quality == 'best' else ['-b:a', quality if quality.endswith('k') else f"{quality}k"])]
+    for key, value in (tags or {}).items():
+        args += ['-metadata', f"{key}={value}"]
+    if ext == 'mp3':
+        args += ['-id3v2_version', '3']
+    try:
+        await run_ffmpeg(*args, partial)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+    os.replace(partial, target)
+    if source != target:
+        os.remove(source)
+    return target
+
+# CPU-bound stage: take finished downloads off the queue and write the final file, one ffmpeg per
+# worker. Each track gets a single ffmpeg run for transcoding, tags and cover art, plus a
+# measuring pass for loudness normalization unless the index already has that track's numbers.
+async def transcode_worker(queue, quality, stage, on_change, on_finished, tracker, metrics=None, post=None, index_db=None):
+    metrics = metrics or RunMetrics()
+    while True:
+        result = await queue.get()
+        if result is None:
+            return
+        stage['active'] += 1
+        on_change()
+        tracker.emit(result['job'], stage='transcode', speed=None, eta=None)
+        action, ext = result.pop('audio_plan', ('encode', 'mp3'))
+        extras = result.pop('audio_post', {})
+        cover = extras.get('cover')
+        try:
+            if action == 'remux':
+                try:
+                    with metrics.span('remux'):
+                        result['path'] = await process_audio(result['path'], ext, tags=extras.get('tags'), cover=cover if ext == 'mp3' else None)
+                    metrics.count('passthrough')
+                    console.print(f"[green]📦 Kept the original audio of {result['title']} (copied into .{ext}, no re-encode)[/green]")
+                except RuntimeError:
+                    # e.g. a webm that turned out to hold Vorbis rather than Opus
+                    action = 'encode'
+            if action == 'encode':
+                audio_filter = None
+                if post and post['loudnorm'] is not None:
+                    target = post['loudnorm']
+                    measured = find_loudness(index_db, result.get('id'), target) if index_db and result.get('id') else None
+                    if measured is None:
+                        tracker.emit(result['job'], stage='loudness')
+                        try:
+                            with metrics.span('loudness'):
+                                measured = await measure_loudness(result['path'], target)
+                            if index_db and result.get('id'):
+                                record_loudness(index_db, result['id'], target, measured)
+                        except (RuntimeError, ValueError, KeyError) as e:
+                            console.print(f"[yellow][!] Could not measure the loudness of {result['title']}, leaving it as is: {e}[/yellow]")
+                        tracker.emit(result['job'], stage='transcode')
+                    else:
+                        metrics.count('loudness_cache_hits')
+                    if measured:
+                        audio_filter = loudnorm_filter(measured, target)
+                with metrics.span('transcode'):
+                    result['path'] = await process_audio(result['path'], 'mp3', quality, extras.get('tags'), cover, audio_filter)
+                console.print(f"[green]🎵 Converted {result['title']} to MP3{' (normalized)' if audio_filter else ''}[/green]")
+        except Exception as e:
+            console.print(f"[red]❌ Failed to convert {result['title']}: {e}[/red]")
+            result['success'] = False
+            result['error'] = str(e)
+        finally:
+            if cover:
+                with contextlib.suppress(OSError):
+                    os.remove(cover)
+            stage['active'] -= 1
+            on_change()
+        on_finished(result)
+
+# Enumerate a playlist without resolving its entries, so the first download can start right away
+def extract_playlist_entries(ydl, url, cache=None):
+    key = normalize_url(url)
+    listing = cache.get('playlist', key) if cache else None
+    if listing:
+        return listing['info'], iter(listing['entries'])
+    info = ydl.extract_info(url, download=False, process=False)
+    while info.get('_type') in ('url', 'url_transparent'):
+        info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return info, iter([info])
+    entries = iter_playlist_entries(ydl, info['entries'])
+    header = ydl.sanitize_info({k: v for k, v in info.items() if k != 'entries'})
+    if cache:
+        entries = cache_playlist_listing(ydl, cache, key, header, entries)
+    return header, entries
+
+# Pass entries through while collecting them; the listing is cached only once fully enumerated,
+# and only up to the cache's size cap, past which collecting stops and what was kept is dropped
+def cache_playlist_listing(ydl, cache, key, header, entries):
+    seen = []
+    for entry in entries:
+        if seen is not None:
+            if len(seen) < cache.max_listing_entries:
+                seen.append(ydl.sanitize_info(entry))
+            else:
+                seen = None
+        yield entry
+    if seen is not None:
+        cache.put('playlist', key, {'info': header, 'entries': seen})
+
+# Walk playlist entries lazily, expanding nested playlists such as channel tabs
+def iter_playlist_entries(ydl, entries):
+    for entry in entries:
+        if not entry:
+            continue
+        if entry.get('_type') == 'url' and entry.get('ie_key') == 'YoutubeTab':
+            entry = ydl.extract_info(entry['url'], download=False, process=False, ie_key='YoutubeTab')
+        if entry.get('_type') in ('playlist', 'multi_video'):
+            yield from iter_playlist_entries(ydl, entry['entries'])
+        else:
+            yield entry
+
+# Read URLs from a batch file ('-' for stdin) lazily, skipping blank lines and # comments
+def read_batch_urls(batch_file):
+    source = sys.stdin if batch_file == '-' else open(batch_file, 'r', encoding='utf-8')
+    try:
+        for line in source:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+# Chain the entries of every batch URL into one lazy stream, dropping repeated URLs and
+# videos already seen in an earlier playlist. URLs that fail to extract become error entries.
+def iter_batch_entries(ydl, urls, cache):
+    seen_urls = set()
+    seen_videos = set()
+    duplicates = 0
+    for url in urls:
+        normalized = normalize_url(url)
+        if normalized in seen_urls:
+            continue
+        seen_urls.add(normalized)
+        try:
+            _, entries = extract_playlist_entries(ydl, url, cache)
+            for entry in entries:
+                key = (entry.get('ie_key') or entry.get('extractor_key'), entry.get('id')) if entry.get('id') else normalize_url(entry.get('webpage_url') or entry.get('url', ''))
+                if key in seen_videos:
+                    duplicates += 1
+                    continue
+                seen_videos.add(key)
+                yield entry
+        except Exception as e:
+            yield {'_type': 'error', 'url': url, 'title': url, 'error': str(e)}
+    if duplicates:
+        console.print(f"[cyan][=] Skipped {duplicates} duplicate video(s) across batch URLs[/cyan]")
+
+# Give a starting download its share of the connections not already in use, holding back an
+# equal share for every idle worker slot. A lone 4K video gets every connection it asks for,
+# and a full pool stays within max_connections in total.
+def connections_for_job(connections, max_connections, in_use, free_slots):
+    return max(1, min(connections, (max_connections - in_use) // max(1, free_slots)))
+
+# yt-dlp options for one download using `connections` parallel fragment/range requests.
+# continuedl keeps .part files across retries so a failed attempt resumes where it stopped.
+def connection_options(connections, chunk_size, range_downloader):
+    options = {
+        'concurrent_fragment_downloads': connections,
+        'http_chunk_size': chunk_size,
+        'continuedl': True,
+        'external_downloader': {},
+        'external_downloader_args': {},
     }
+    if range_downloader == 'aria2c' and connections > 1:
+        options['external_downloader'] = {'http': 'aria2c'}
+        options['external_downloader_args'] = {'aria2c': ['-x', str(connections), '-s', str(connections), '-k', '1M', '--continue=true']}
+    return options
+
+# Build the yt-dlp command line for the subprocess engine
+def build_download_command(video, output_path, download_type, quality, format_spec, is_playlist, cookies_browser='firefox', connection_opts=None, cookie_file=None, staging_path=None):
+    # MP3 conversion is left to the transcode stage, so only the source audio is fetched here
+    command = ['yt-dlp']
+    if staging_path:
+        # Partial and intermediate files stay in staging; an MP3 source stays there for the transcode stage
+        command.extend(['--paths', f"home:{staging_path if download_type == 'mp3' else output_path}", '--paths', f"temp:{staging_path}", '--output', '%(title)s.%(ext)s'])
+    else:
+        command.extend(['--output', os.path.join(output_path, '%(title)s.%(ext)s')])
+    command.extend([
+        '--format', format_spec,
+        '--quiet',
+        '--no-warnings',
+        '--print', 'after_move:filepath',
+        '--progress', '--newline', '--progress-template', PROGRESS_TEMPLATE,
+        '--continue',
+    ])
+    if connection_opts:
+        command.extend(['--concurrent-fragments', str(connection_opts['concurrent_fragment_downloads'])])
+        if connection_opts['http_chunk_size']:
+            command.extend(['--http-chunk-size', str(connection_opts['http_chunk_size'])])
+        if connection_opts['external_downloader']:
+            command.extend(['--downloader', 'http:aria2c', '--downloader-args', 'aria2c:' + ' '.join(connection_opts['external_downloader_args']['aria2c'])])
+    # A cookie file exported once per run is much cheaper than decrypting the browser profile per video
+    if cookie_file:
+        command.extend(['--cookies', cookie_file])
+    elif cookies_browser:
+        command.extend(['--cookies-from-browser', cookies_browser])
+    command.append(video.get('webpage_url') or video['url'])
+    if download_type == 'video':
+        command.extend(['--merge-output-format', 'mp4'])
+    if is_playlist:
+        command.append('--yes-playlist')
+    else:
+        command.append('--no-playlist')
+    return command
+
+# Build a YoutubeDL sharing another instance's extractor registry; registering the default
+# extractors from scratch costs ~100ms per instance, which dominated short runs
+def clone_youtube_dl(ydl, ydl_opts):
+    import yt_dlp
+    clone = yt_dlp.YoutubeDL(ydl_opts, auto_init=False)
+    for ie in ydl._ies.values():
+        clone.add_info_extractor(ie)
+    return clone
+
+# Point a YoutubeDL at another instance's cookie jar and HTTP handlers, so a run decrypts
+# browser cookies once and all workers share one set of keep-alive connections. The handlers
+# count their users, and close_youtube_dl only shuts them down once the last one is closed.
+def share_session(ydl, source):
+    ydl.__dict__['cookiejar'] = source.cookiejar
+    ydl.borrowed_session = True
+    if '_request_director' not in ydl.__dict__:
+        director = source._request_director
+        with SESSION_LOCK:
+            director.session_users = getattr(director, 'session_users', 1) + 1
+        ydl.__dict__['_request_director'] = director
+
+# Close a YoutubeDL without pulling shared HTTP handlers or cookies out from under the other
+# instances using them; YoutubeDL.close() would close the handlers outright
+def close_youtube_dl(ydl):
+    director = ydl.__dict__.pop('_request_director', None)
+    if director is not None:
+        with SESSION_LOCK:
+            director.session_users = getattr(director, 'session_users', 1) - 1
+            last = director.session_users <= 0
+        if last:
+            director.close()
+    if getattr(ydl, 'borrowed_session', False):
+        ydl.__dict__.pop('cookiejar', None)
+    ydl.close()
+
+# Write a cookie jar in Netscape format, readable only by the current user
+def write_cookie_file(jar, path):
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+    jar.save(path, ignore_discard=True, ignore_expires=True)
+
+# Load browser cookies at most once per `ttl` seconds in this process. A reload refills the
+# same jar object, so YoutubeDL instances and HTTP handlers holding it see the new cookies.
+# With cache_file, the export is also reused across runs while the file is younger than
+# `ttl`; expired cookies are dropped on load, and an empty result forces a fresh extraction.
+def load_browser_cookies(browser, ttl=DEFAULT_COOKIE_TTL, cache_file=None, ydl=None):
+    import yt_dlp.cookies
+    cached = COOKIE_JARS.get(browser)
+    now = time.time()
+    if cached and now - cached['loaded_at'] < ttl:
+        return cached['jar']
+    fresh, loaded_at = None, now
+    if cache_file and os.path.isfile(cache_file) and now - os.path.getmtime(cache_file) < ttl:
+        fresh = yt_dlp.cookies.YoutubeDLCookieJar(cache_file)
+        try:
+            fresh.load(ignore_discard=True)
+        except OSError:
+            fresh = None
+        if fresh is not None:
+            fresh.clear_expired_cookies()
+            if len(fresh):
+                loaded_at = os.path.getmtime(cache_file)
+            else:
+                fresh = None
+    if fresh is None:
+        console.print(f"[cyan][+] Loading cookies from {browser}...[/cyan]")
+        fresh = yt_dlp.cookies.extract_cookies_from_browser(browser, logger=yt_dlp.cookies.YDLLogger(ydl))
+        if cache_file:
+            write_cookie_file(fresh, cache_file)
+    if cached:
+        jar = cached['jar']
+        jar.clear()
+        for cookie in fresh:
+            jar.set_cookie(cookie)
+    else:
+        jar = fresh
+    COOKIE_JARS[browser] = {'jar': jar, 'loaded_at': loaded_at}
+    return jar
+
+# Idle YoutubeDL instances kept between download_media runs (daemon mode), keyed by their
+# options. Reusing them keeps loaded cookies, the extractor registry and open HTTP sessions.
+class YoutubeDLPool:
+    def __init__(self, max_idle=16):
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.max_idle = max_idle
+
+    # `session` names the cookie source, which is attached after construction rather than via options
+    def _key(self, ydl_opts, session=None):
+        return json.dumps([ydl_opts, session], sort_keys=True, default=str)
+
+    def take(self, ydl_opts, template=None, session=None):
+        import yt_dlp
+        with self.lock:
+            instances = self.idle.get(self._key(ydl_opts, session))
+            if instances:
+                return instances.pop()
+            template = template or next((ydls[0] for ydls in self.idle.values() if ydls), None)
+        return clone_youtube_dl(template, ydl_opts) if template else yt_dlp.YoutubeDL(ydl_opts)
+
+    def give(self, ydl_opts, ydl, session=None):
+        with self.lock:
+            instances = self.idle.setdefault(self._key(ydl_opts, session), [])
+            if len(instances) < self.max_idle:
+                instances.append(ydl)
+                return
+        close_youtube_dl(ydl)
+
+    def close(self):
+        with self.lock:
+            instances = [ydl for ydls in self.idle.values() for ydl in ydls]
+            self.idle.clear()
+        for ydl in instances:
+            close_youtube_dl(ydl)
+
+# Open (and create if needed) the download index. Entries are per output directory, so syncing
+# the same video into several directories keeps a copy in each.
+def open_download_index(path=INDEX_DB):
+    conn = sqlite3.connect(path)
+    # Indexes from before output directories were part of the key: each row's directory is its file's
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(downloads)")]
+    old_rows = []
+    if columns and 'output_dir' not in columns:
+        old_rows = conn.execute("SELECT video_id, download_type, quality, path, size, downloaded_at FROM downloads").fetchall()
+        with conn:
+            conn.execute("DROP TABLE downloads")
+    conn.execute("""CREATE TABLE IF NOT EXISTS downloads (
+        video_id TEXT NOT NULL,
+        download_type TEXT NOT NULL,
+        quality TEXT NOT NULL,
+        output_dir TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        downloaded_at TEXT NOT NULL,
+        PRIMARY KEY (video_id, download_type, quality, output_dir)
+    )""")
+    if old_rows:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(video_id, download_type, quality, os.path.dirname(os.path.abspath(file_path)), file_path, size, downloaded_at) for video_id, download_type, quality, file_path, size, downloaded_at in old_rows]
+            )
+    conn.execute("""CREATE TABLE IF NOT EXISTS loudness (
+        video_id TEXT NOT NULL,
+        target REAL NOT NULL,
+        measured TEXT NOT NULL,
+        PRIMARY KEY (video_id, target)
+    )""")
+    return conn
+
+# Record a finished download in the index, under the output directory it was made for
+def record_download(conn, video_id, download_type, quality, output_dir, path):
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (video_id, download_type, quality, os.path.abspath(output_dir), path, os.path.getsize(path), datetime.now().isoformat(timespec='seconds'))
+        )
+
+# Return the indexed path if the file is still on disk at the recorded size, dropping stale rows
+def find_download(conn, video_id, download_type, quality, output_dir):
+    output_dir = os.path.abspath(output_dir)
+    row = conn.execute(
+        "SELECT path, size FROM downloads WHERE video_id = ? AND download_type = ? AND quality = ? AND output_dir = ?",
+        (video_id, download_type, quality, output_dir)
+    ).fetchone()
+    if not row:
+        return None
+    path, size = row
+    if os.path.isfile(path) and os.path.getsize(path) == size:
+        return path
+    with conn:
+        conn.execute(
+            "DELETE FROM downloads WHERE video_id = ? AND download_type = ? AND quality = ? AND output_dir = ?",
+            (video_id, download_type, quality, output_dir)
+        )
+    return None
+
+# Loudness measured for a video at a loudnorm target, from an earlier run
+def find_loudness(conn, video_id, target):
+    row = conn.execute("SELECT measured FROM loudness WHERE video_id = ? AND target = ?", (video_id, target)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def record_loudness(conn, video_id, target, measured):
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?)", (video_id, target, json.dumps(measured)))
+
+# Normalize a URL so equivalent links share one cache entry
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    # Share/tracking parameters do not change what the URL resolves to
+    query = sorted((k, v) for k, v in parse_qsl(parts.query) if k not in ('si', 'feature', 'pp', 'index', 't'))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), urlencode(query), ''))
+
+# JSON files keyed by hash, with per-kind TTLs and LRU eviction once the cache outgrows max_bytes.
+# A file's mtime doubles as its last-access time.
+class MetadataCache:
+    def __init__(self, cache_dir=METADATA_CACHE_DIR, playlist_ttl=3600, video_ttl=3600, max_bytes=256 * 1024 * 1024, refresh=False, max_listing_entries=DEFAULT_PLAYLIST_CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_listing_entries = max_listing_entries
+        self.ttls = {'playlist': playlist_ttl, 'video': video_ttl}
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.name.endswith('.json'))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, kind, key):
+        if self.refresh:
+            return None
+        path = self._path(f"{kind}:{key}")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('cached_at', 0) > self.ttls[kind]:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry['data']
+
+    def put(self, kind, key, data):
+        path = self._path(f"{kind}:{key}")
+        payload = json.dumps({'cached_at': time.time(), 'data': data})
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        with self.lock:
+            try:
+                self.total_bytes -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+            self.total_bytes += len(payload.encode('utf-8'))
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    # Drop least recently used files until the cache is back under 90% of its budget
+    def _evict(self):
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(self.cache_dir) if entry.name.endswith('.json'))
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except OSError:
+                pass
+
+# Linux ioctl that makes `target` share `source`'s extents (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# Copy-on-write clone of a file; False where the OS or filesystem can't do it
+def reflink_file(source, target):
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(target)
+        return False
+
+# Put `source` at `target` as cheaply as possible: hardlink, then reflink, then (if allowed) a
+# plain copy for targets on another filesystem. Returns the method used, or None.
+def link_file(source, target, allow_copy=True):
+    try:
+        os.link(source, target)
+        return 'hardlink'
+    except OSError:
+        pass
+    if reflink_file(source, target):
+        return 'reflink'
+    if allow_copy:
+        shutil.copy2(source, target)
+        return 'copy'
+    return None
+
+# Key for one artifact: the same video fetched with the same format and quality settings
+def store_key(video, download_type, quality, format_spec):
+    extractor = video.get('extractor_key') or video.get('ie_key') or ''
+    if not video.get('id'):
+        return None
+    return hashlib.sha1(json.dumps([extractor, video['id'], download_type, quality, format_spec]).encode('utf-8')).hexdigest()
+
+# Peak bytes a job puts on disk, from the extracted sizes (exact or approximate); 0 when unknown.
+# Merging and transcoding write their output while the inputs still exist, hence the factor 2.
+def estimate_disk_need(video, download_type, chosen=None):
+    fmt = chosen or video
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and not chosen:
+        size = sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in video.get('requested_formats') or [])
+    if not size and not chosen:
+        # Format not selected yet: assume the largest one on offer
+        size = max((f.get('filesize') or f.get('filesize_approx') or 0 for f in video.get('formats') or []), default=0)
+    if not size:
+        return 0
+    return int(size * (2 if download_type == 'mp3' or video.get('requested_formats') else 1))
+
+# Disk admission control. A job reserves its expected peak size before it starts and waits while
+# the reservations on its volume would eat into the `min_free` headroom. Free space is read again
+# for every decision, so other writers (including other runs) are accounted for; bytes a running
+# job has already written count twice until it finishes, which errs on the safe side.
+class DiskBudget:
+    def __init__(self, min_free=0):
+        self.min_free = min_free
+        self.reserved = {}
+        self.changed = asyncio.Event()
+
+    # Device and nearest existing directory for a path that may not exist yet
+    def _volume(self, path):
+        probe = os.path.abspath(path)
+        while not os.path.exists(probe) and os.path.dirname(probe) != probe:
+            probe = os.path.dirname(probe)
+        return os.stat(probe).st_dev, probe
+
+    async def reserve(self, path, need, on_wait=None):
+        device, probe = self._volume(path)
+        waiting = False
+        while True:
+            available = shutil.disk_usage(probe).free - self.min_free - self.reserved.get(device, 0)
+            if need <= available:
+                break
+            # Nothing else holds space here, so waiting would not help
+            if not self.reserved.get(device):
+                raise OSError(errno.ENOSPC, f"Not enough disk space: needs {format_bytes(need)}, {format_bytes(max(available, 0))} free above the {format_bytes(self.min_free)} reserve")
+            if not waiting and on_wait:
+                on_wait()
+            waiting = True
+            self.changed.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.changed.wait(), 5)
+        self.reserved[device] = self.reserved.get(device, 0) + need
+        return {'device': device, 'bytes': need}
+
+    # Give a reservation back; safe to call more than once
+    def release(self, reservation):
+        if reservation and reservation['bytes']:
+            self.reserved[reservation['device']] -= reservation['bytes']
+            reservation['bytes'] = 0
+        self.changed.set()
+
+# Free-space headroom in bytes, from a size such as '2G' (default: min_free_space in config.ini)
+def load_min_free_space(value=None):
+    import yt_dlp
+    value = value or load_config().get('min_free_space', DEFAULT_MIN_FREE_SPACE)
+    if str(value).strip() == '0':
+        return 0
+    parsed = yt_dlp.utils.parse_bytes(str(value))
+    if parsed is None:
+        console.print(f"[red]⚠️ Invalid min free space '{value}'. Using {DEFAULT_MIN_FREE_SPACE}.[/red]")
+        parsed = yt_dlp.utils.parse_bytes(DEFAULT_MIN_FREE_SPACE)
+    return parsed
+
+# Move a finished file from the staging directory into the output directory. Both are on the same
+# filesystem, so the rename is atomic: readers see either no file or the complete one.
+def publish_file(path, output_path):
+    target = os.path.join(output_path, os.path.basename(path))
+    os.makedirs(output_path, exist_ok=True)
+    os.replace(path, target)
+    return target
+
+# Content-addressed store of finished downloads. Objects live under objects/ (hardlinked or
+# reflinked from the first output that produced them); when neither works, the first output
+# itself is registered as the object. Every placed copy is recorded as a ref, and gc() drops
+# objects whose refs are all gone.
+class MediaStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'store.db'))
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS objects (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS refs (
+                key TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (key, path)
+            )""")
+
+    def _object_path(self, key, ext):
+        return os.path.join(self.root, 'objects', key[:2], key + ext)
+
+    # Path of the stored object if it is still intact
+    def find(self, key):
+        row = self.conn.execute("SELECT path, size FROM objects WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        path, size = row
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            return path
+        with self.conn:
+            self.conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+        return None
+
+    # Register a finished file under `key`
+    def add(self, key, path):
+        if self.find(key):
+            self.add_ref(key, path)
+            return
+        target = self._object_path(key, os.path.splitext(path)[1])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(target)
+        stored = target if link_file(path, target, allow_copy=False) else os.path.abspath(path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)",
+                (key, stored, os.path.getsize(stored), datetime.now().isoformat(timespec='seconds'))
+            )
+        self.add_ref(key, path)
+
+    def add_ref(self, key, path):
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO refs VALUES (?, ?)", (key, os.path.abspath(path)))
+
+    # Materialize the object for `key` at `target`. Returns the method used, or None when the
+    # object is missing or `target` is taken by some other file.
+    def place(self, key, target):
+        source = self.find(key)
+        if not source:
+            return None
+        if os.path.exists(target):
+            if not os.path.samefile(source, target):
+                return None
+            method = 'existing'
+        else:
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            tmp_target = f"{target}.store.tmp"
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_target)
+            method = link_file(source, tmp_target)
+            os.replace(tmp_target, target)
+        self.add_ref(key, target)
+        return method
+
+    # Forget refs whose files are gone and delete objects nobody references any more
+    def gc(self):
+        refs = self.conn.execute("SELECT key, path FROM refs").fetchall()
+        with self.conn:
+            self.conn.executemany("DELETE FROM refs WHERE key = ? AND path = ?", [(key, path) for key, path in refs if not os.path.exists(path)])
+        removed, freed = 0, 0
+        objects_dir = os.path.abspath(os.path.join(self.root, 'objects'))
+        for key, path, size in self.conn.execute("SELECT key, path, size FROM objects").fetchall():
+            # An object registered in place (no link possible) lives as long as that file does
+            owned = os.path.abspath(path).startswith(objects_dir + os.sep)
+            if os.path.isfile(path) and (not owned or self.conn.execute("SELECT 1 FROM refs WHERE key = ? LIMIT 1", (key,)).fetchone()):
+                continue
+            if owned and os.path.isfile(path):
+                os.remove(path)
+                removed += 1
+                freed += size
+            with self.conn:
+                self.conn.execute("DELETE FROM objects WHERE key = ?", (key,))
+                self.conn.execute("DELETE FROM refs WHERE key = ?", (key,))
+        # Files left behind by an interrupted add()
+        known = {os.path.abspath(path) for (path,) in self.conn.execute("SELECT path FROM objects")}
+        for dirpath, _, filenames in os.walk(objects_dir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if path not in known:
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+        return removed, freed
+
+    def close(self):
+        self.conn.close()
+
+# Open the media store from config.ini; store_dir=none turns it off
+def load_media_store():
+    store_dir = load_config().get('store_dir', STORE_DIR)
+    if store_dir.lower() == 'none':
+        return None
+    return MediaStore(store_dir)
+
+# Build the metadata cache from config.ini
+def load_metadata_cache(refresh=False):
+    config = load_config()
+    return MetadataCache(
+        cache_dir=config.get('metadata_cache_dir', METADATA_CACHE_DIR),
+        playlist_ttl=int(config.get('playlist_cache_ttl', 3600)),
+        video_ttl=int(config.get('video_cache_ttl', 3600)),
+        max_bytes=int(config.get('metadata_cache_max_mb', 256)) * 1024 * 1024,
+        refresh=refresh,
+        max_listing_entries=int(config.get('playlist_cache_max_entries', DEFAULT_PLAYLIST_CACHE_MAX_ENTRIES)),
+    )
+
+# extract_info through the metadata cache
+def cached_extract_info(ydl, url, kind, cache):
+    key = normalize_url(url)
+    info = cache.get(kind, key)
+    if info is None:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+        cache.put(kind, key, info)
+    return info
+
+# Resolve a flat playlist entry through the metadata cache, keyed by video ID
+def cached_resolve_entry(ydl, entry, cache):
+    key = f"{entry.get('ie_key') or entry.get('extractor_key', '')}:{entry.get('id')}" if entry.get('id') else normalize_url(entry.get('url', ''))
+    info = cache.get('video', key)
+    if info is None:
+        info = ydl.sanitize_info(ydl.process_ie_result(entry, download=False))
+        cache.put('video', key, info)
+    return info
+
+# Options download_media takes besides what to fetch and where, with their defaults. None means
+# the setting comes from config.ini (or its built-in default).
+DOWNLOAD_OPTIONS = {
+    # Tuning, mirroring the CLI flags
+    'jobs': None, 'transcode_jobs': None, 'engine': None, 'stream': True, 'sync': False, 'refresh': False,
+    'connections': None, 'max_connections': None, 'chunk_size': None, 'range_downloader': None, 'rate': None, 'retries': None,
+    'store': True, 'passthrough': None, 'normalize': None, 'tags': None, 'min_free_space': None,
+    # Other sources of items than the URL, and the JSONL report
+    'batch_urls': None, 'entries': None, 'report_path': None,
+    # State shared with or watched by long-lived callers (GUI, daemon, queue workers, benchmarks)
+    'tracker': None, 'dashboard': True, 'metrics': None, 'warm': None, 'throttle': None, 'disk': None, 'on_result': None,
+}
+
+# Resolve a run's settings from its options and config.ini, once, before anything starts
+def load_run_settings(output_path, download_type, quality, is_playlist, options):
+    import yt_dlp
+    config = load_config()
+    default_quality, default_video_quality, max_parallel = load_settings()
+    engine = options['engine'] or config.get('engine', 'inprocess')
+    if engine not in ENGINES:
+        console.print(f"[red]⚠️ Unknown engine '{engine}'. Using inprocess.[/red]")
+        engine = 'inprocess'
+    quality = quality or (default_quality if download_type == 'mp3' else default_video_quality)
+    staging_path = os.path.join(output_path, STAGING_DIR)
+    video_formats = {label: f"bestvideo[height<=?{height}]+bestaudio/best" for label, height in VIDEO_HEIGHTS.items()}
     ydl_opts = {
-        'format': 'bestaudio/best' if download_type == 'mp3' else quality_map.get(quality, 'bestvideo+bestaudio/best'),
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': quality if quality != 'best' else '0',
-        }] if download_type == 'mp3' else [],
-        'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
+        'format': 'bestaudio/best' if download_type == 'mp3' else video_formats.get(quality, 'bestvideo+bestaudio/best'),
+        'outtmpl': '%(title)s.%(ext)s',
+        # Everything is written in staging and renamed into output_path when complete: by yt-dlp
+        # for videos, by finish_video for MP3 sources that still go through the transcode stage
+        'paths': {'home': staging_path if download_type == 'mp3' else output_path, 'temp': staging_path},
         'noplaylist': not is_playlist,
         'quiet': True,
         'no_warnings': True,
-        'cookiesfrombrowser': ('firefox',),  # Use Firefox cookies to bypass 403
+        'noprogress': True,  # Progress comes through hooks instead of yt-dlp's own output
     }
     if download_type == 'video':
         ydl_opts['merge_output_format'] = 'mp4'
+    # Use browser cookies (Firefox by default) to bypass 403; cookies_browser=none in config.ini turns this off.
+    # They are loaded once per run (see load_browser_cookies) instead of via cookiesfrombrowser,
+    # which would decrypt the profile again in every YoutubeDL instance and subprocess.
+    cookies_browser = config.get('cookies_browser', 'firefox')
+    cookies_browser = None if cookies_browser.lower() == 'none' else cookies_browser
+    # Connections per download and in total; each job's share is worked out when it starts
+    chunk_size = options['chunk_size'] or config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    if chunk_size.lower() in ('0', 'none'):
+        chunk_size = None
+    else:
+        parsed_chunk_size = yt_dlp.utils.parse_bytes(chunk_size)
+        if not parsed_chunk_size:
+            console.print(f"[red]⚠️ Invalid chunk size '{chunk_size}'. Using {DEFAULT_CHUNK_SIZE}.[/red]")
+            parsed_chunk_size = yt_dlp.utils.parse_bytes(DEFAULT_CHUNK_SIZE)
+        chunk_size = parsed_chunk_size
+    range_downloader = options['range_downloader'] or config.get('range_downloader', 'native')
+    if range_downloader == 'aria2c' and not shutil.which('aria2c'):
+        console.print("[yellow][!] aria2c not found. Using yt-dlp's native downloader.[/yellow]")
+        range_downloader = 'native'
+    connections = options['connections'] or int(config.get('connections', DEFAULT_CONNECTIONS))
+    ydl_opts.update(connection_options(connections, chunk_size, range_downloader))
+    # In MP3 mode, keep Opus/AAC/MP3 sources as they are (remuxed at most) instead of re-encoding
+    passthrough = options['passthrough']
+    if passthrough is None:
+        passthrough = config.get('audio_passthrough', 'false').lower() in ('1', 'true', 'yes', 'on')
+    passthrough = passthrough and download_type == 'mp3'
+    # Tags, cover art and loudness normalization, all applied in the one ffmpeg run per MP3
+    post = load_audio_post(config, options['normalize'], options['tags']) if download_type == 'mp3' else None
+    # Normalizing changes the samples, so there is nothing left to pass through
+    if passthrough and post['loudnorm'] is not None:
+        console.print("[yellow][!] Loudness normalization re-encodes every track, so passthrough is off for this run[/yellow]")
+        passthrough = False
+    return {
+        'quality': quality,
+        'max_parallel': options['jobs'] or max_parallel,
+        'transcode_jobs': options['transcode_jobs'] or int(config.get('transcode_workers', 0)) or os.cpu_count() or 1,
+        'engine': engine,
+        'staging_path': staging_path,
+        'ydl_opts': ydl_opts,
+        'cookies_browser': cookies_browser,
+        'cookie_ttl': int(config.get('cookie_ttl', DEFAULT_COOKIE_TTL)),
+        'cookie_cache_file': config.get('cookie_cache_file') or None,
+        'connections': connections,
+        'max_connections': options['max_connections'] or int(config.get('max_connections', DEFAULT_MAX_CONNECTIONS)),
+        'chunk_size': chunk_size,
+        'range_downloader': range_downloader,
+        # Download starts per second per host; 0 turns the token bucket off (backoff and breaker stay on)
+        'rate': options['rate'] if options['rate'] is not None else float(config.get('requests_per_second', DEFAULT_REQUESTS_PER_SECOND)),
+        'burst': int(config.get('burst', DEFAULT_BURST)),
+        'retries': options['retries'] or int(config.get('retries', DEFAULT_RETRIES)),
+        'passthrough': passthrough,
+        'post': post,
+    }
 
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            videos = info['entries'] if is_playlist else [info]
-            total_videos = len(videos)
-            console.print(f"[cyan][+] Found {total_videos} video(s) in {'playlist' if is_playlist else 'video'}[/cyan]")
-            
-            success_count = 0
-            for i, video in enumerate(videos, 1):
-                actual_quality = quality if download_type == 'mp3' else get_actual_quality(video, quality)
-                console.print(f"[cyan][+] Processing video {i}/{total_videos}: {video.get('title', 'Unknown Title')} ({'Audio' if download_type == 'mp3' else f'Video at {actual_quality}'})[/cyan]")
-                command = [
-                    'yt-dlp',
-                    '-x' if download_type == 'mp3' else '',
-                ]
-                if download_type == 'mp3':
-                    command.extend(['--audio-format', 'mp3', '--audio-quality', quality if quality != 'best' else '0'])
-                command.extend([
-                    '--format', ydl_opts['format'],
-                    '--output', os.path.join(output_path, '%(title)s.%(ext)s'),
-                    '--quiet',
-                    '--no-warnings',
-                    '--cookies-from-browser', 'firefox',
-                    video['webpage_url']
-                ])
-                if download_type == 'video':
-                    command.extend(['--merge-output-format', 'mp4'])
-                if is_playlist:
-                    command.append('--yes-playlist')
+# One download_media run: its settings, the files and stores it holds open, and the pipeline.
+# In MP3 mode that has two stages: download slots hand files to the ffmpeg transcode pool through
+# a bounded queue, so the network slots keep fetching while ffmpeg works (and wait if it falls
+# behind). process_video takes an item as far as it goes in its slot; finish_video records it
+# once it has reached its final form.
+class DownloadRun:
+    def __init__(self, output_path, download_type, is_playlist, settings, options):
+        self.output_path = output_path
+        self.download_type = download_type
+        self.is_playlist = is_playlist
+        self.settings = settings
+        self.options = options
+        self.quality = settings['quality']
+        self.staging_path = settings['staging_path']
+        # Disk admission: jobs reserve their expected size and wait while the volume is too full.
+        # A daemon passes one budget shared by all of its jobs.
+        self.disk = options['disk'] or DiskBudget(load_min_free_space(options['min_free_space']))
+        # Per-stage timings and counters; the caller passes its own to export them (or, in daemon mode, to aggregate)
+        self.metrics = options['metrics'] or RunMetrics()
+        self.tracker = options['tracker'] or ProgressTracker()
+        # A daemon passes one throttle shared by all of its jobs; otherwise it is sized in execute()
+        self.throttle = options['throttle']
+        self.index_db = open_download_index()
+        self.media_store = load_media_store() if options['store'] else None
+        self.cache = load_metadata_cache(refresh=options['refresh'])
+        self.report_file = open(options['report_path'], 'w', encoding='utf-8') if options['report_path'] else None
+        self.cookie_dir = None
+        self.ydl = None
+        self.stream = False
+        self.total_videos = None
+        self.workers = 1
+        self.executor = None
+        self.ydl_pool = asyncio.Queue()
+        self.resolve_pool = asyncio.Queue()
+        self.download_queue = None
+        self.transcode_queue = None
+        self.stages = {'download': {'active': 0}, 'transcode': {'active': 0}}
+        self.connections_in_use = 0
+        # Disk reservations of items still in flight, given back on the way out should the run end
+        # early: `disk` may be the daemon's, shared with later runs
+        self.reservations = {}
+
+    def close(self):
+        self.index_db.close()
+        if self.media_store:
+            self.media_store.close()
+        if self.report_file:
+            self.report_file.close()
+        if self.cookie_dir:
+            shutil.rmtree(self.cookie_dir, ignore_errors=True)
+        # Partial downloads are kept for the next run to resume; otherwise the staging dir goes
+        with contextlib.suppress(OSError):
+            os.rmdir(self.staging_path)
+
+    # Take the run's extraction instance and load browser cookies into it, once for every worker
+    def attach(self, ydl):
+        self.ydl = ydl
+        cookies_browser = self.settings['cookies_browser']
+        if cookies_browser:
+            ydl.__dict__['cookiejar'] = load_browser_cookies(cookies_browser, self.settings['cookie_ttl'], self.settings['cookie_cache_file'], ydl)
+            if self.settings['engine'] == 'subprocess':
+                # Each yt-dlp process writes its jar back on exit, so every job gets its own file
+                self.cookie_dir = tempfile.mkdtemp(prefix='ytd-cookies-')
+
+    # The items to download, and how many workers they get
+    async def list_videos(self, url):
+        options, metrics = self.options, self.metrics
+        loop = asyncio.get_running_loop()
+        max_parallel = self.settings['max_parallel']
+        self.workers = max(1, max_parallel)
+        # Streaming only pays off for playlists; a single video is resolved up front as before.
+        # A batch is always streamed, as one deduplicated chain of every URL's entries.
+        self.stream = options['batch_urls'] is not None or options['entries'] is not None or (options['stream'] and self.is_playlist)
+        if options['entries'] is not None:
+            # Pre-built info dicts (used by the benchmarks) skip extraction entirely
+            videos = options['entries']
+            self.total_videos = len(videos) if hasattr(videos, '__len__') else None
+        elif options['batch_urls'] is not None:
+            videos = timed_entries(iter_batch_entries(self.ydl, options['batch_urls'], self.cache), metrics)
+            console.print("[cyan][+] Streaming batch URLs...[/cyan]")
+        elif self.stream:
+            with metrics.span('extract'):
+                info, videos = await loop.run_in_executor(None, extract_playlist_entries, self.ydl, url, self.cache)
+            # Later pages are fetched lazily while the downloads run
+            videos = timed_entries(videos, metrics)
+            self.total_videos = info.get('playlist_count')
+            if self.total_videos:
+                console.print(f"[cyan][+] Found {self.total_videos} video(s) in playlist[/cyan]")
+            else:
+                console.print("[cyan][+] Streaming playlist entries...[/cyan]")
+        else:
+            kind = 'playlist' if self.is_playlist else 'video'
+            with metrics.span('extract'):
+                info = await loop.run_in_executor(None, cached_extract_info, self.ydl, url, kind, self.cache)
+            videos = info['entries'] if self.is_playlist else [info]
+            self.total_videos = len(videos)
+            console.print(f"[cyan][+] Found {self.total_videos} video(s) in {kind}[/cyan]")
+            self.workers = max(1, min(max_parallel, self.total_videos))
+        return videos
+
+    # A YoutubeDL for a worker or resolver: warm from the pool when there is one, sharing the
+    # extraction instance's cookies and HTTP connections either way
+    def take_instance(self):
+        warm, ydl_opts = self.options['warm'], self.settings['ydl_opts']
+        instance = warm.take(ydl_opts, self.ydl, self.settings['cookies_browser']) if warm else clone_youtube_dl(self.ydl, ydl_opts)
+        share_session(instance, self.ydl)
+        return instance
+
+    # One warm YoutubeDL per worker. When not streaming, the extraction instance is reused as
+    # the first one; when streaming it keeps enumerating the playlist, and resolvers get their
+    # own instances.
+    def start_workers(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.workers * 2 + 1)
+        if self.settings['engine'] != 'inprocess':
+            return
+        if not self.stream:
+            self.ydl_pool.put_nowait(attach_progress_hook(self.ydl))
+        while self.ydl_pool.qsize() < self.workers:
+            self.ydl_pool.put_nowait(attach_progress_hook(self.take_instance()))
+        if self.stream:
+            for _ in range(self.workers):
+                self.resolve_pool.put_nowait(self.take_instance())
+
+    # Hand the run's instances back to the warm pool, or close them. A cancelled run may still
+    # have a download unwinding on an executor thread, so its instances aren't reused.
+    def close_workers(self):
+        warm = self.options['warm']
+        self.executor.shutdown(wait=False)
+        instances = {id(self.ydl): self.ydl}
+        while not self.ydl_pool.empty():
+            worker_ydl, _ = self.ydl_pool.get_nowait()
+            instances[id(worker_ydl)] = worker_ydl
+        while not self.resolve_pool.empty():
+            resolver = self.resolve_pool.get_nowait()
+            instances[id(resolver)] = resolver
+        for instance in instances.values():
+            if warm and not self.tracker.cancelled:
+                warm.give(self.settings['ydl_opts'], instance, self.settings['cookies_browser'])
+            elif warm or instance is not self.ydl:
+                close_youtube_dl(instance)
+
+    # In sync mode, an entry is skipped when the index points at an intact file in this output directory
+    def already_downloaded(self, video):
+        if not self.options['sync'] or not video.get('id'):
+            return None
+        return find_download(self.index_db, video['id'], self.download_type, self.quality, self.output_path)
+
+    # Key of this item in the media store, if the store is on and the item has an ID
+    def media_key(self, video):
+        if not self.media_store:
+            return None
+        format_spec, post = self.settings['ydl_opts']['format'], self.settings['post']
+        # MP3s differ by their ffmpeg settings too, so those are part of the key
+        format_key = [format_spec, 'passthrough' if self.settings['passthrough'] else None, post] if post else format_spec
+        return store_key(video, self.download_type, self.quality, format_key)
+
+    # Link an identical artifact from the media store into output_path; returns (path, method)
+    def place_from_store(self, video):
+        key = self.media_key(video)
+        source = self.media_store.find(key) if key else None
+        if not source:
+            return None, None
+        target = os.path.join(self.output_path, os.path.basename(self.ydl.prepare_filename(dict(video, ext=os.path.splitext(source)[1][1:]))))
+        with self.metrics.span('link'):
+            method = self.media_store.place(key, target)
+        return (target, method) if method else (None, None)
+
+    # Resolve formats for a flat playlist entry; the subprocess engine re-extracts anyway
+    async def resolve_video(self, index, entry):
+        # Only flat url entries need resolving; full video dicts already carry their formats,
+        # and items already on disk or in the media store aren't downloaded at all
+        if entry.get('_type', 'video') in ('video', 'error') or self.already_downloaded(entry):
+            return entry
+        key = self.media_key(entry)
+        if key and self.media_store.find(key):
+            return entry
+        # Resolving fetches the watch page, so it waits out a tripped breaker and takes a
+        # token like a download start; the resolver pool already bounds how many run
+        await self.throttle.acquire(throttle_host(entry), slot=False)
+        resolver = await self.resolve_pool.get()
+        try:
+            with self.metrics.span('resolve'):
+                return await asyncio.get_running_loop().run_in_executor(self.executor, cached_resolve_entry, resolver, entry, self.cache)
+        finally:
+            self.resolve_pool.put_nowait(resolver)
+
+    def set_total(self, count):
+        if self.total_videos != count:
+            console.print(f"[cyan][+] Found {count} video(s) in playlist[/cyan]")
+        self.total_videos = count
+        self.tracker.set_total(count)
+
+    def report_stages(self):
+        if self.download_type == 'mp3':
+            self.tracker.set_stage('Download', self.stages['download']['active'], self.download_queue.qsize())
+            self.tracker.set_stage('Transcode', self.stages['transcode']['active'], self.transcode_queue.qsize())
+
+    # Record a finished item once it has reached its final form
+    def finish_video(self, result):
+        reservation = result.pop('disk_reservation', None)
+        if reservation:
+            self.disk.release(self.reservations.pop(id(reservation), reservation))
+        # MP3 mode leaves its files in staging until they are final
+        if result['success'] and result['path'] and os.path.dirname(result['path']) == self.staging_path:
+            try:
+                result['path'] = publish_file(result['path'], self.output_path)
+            except OSError as e:
+                console.print(f"[red]❌ Failed to move {result['title']} into {self.output_path}: {e}[/red]")
+                result.update(success=False, error=str(e))
+        status = 'linked' if result.get('linked') else 'skipped' if result.get('skipped') else 'done' if result['success'] else 'failed'
+        self.tracker.finish(result.pop('job', None), 'skipped' if status == 'linked' else status)
+        result['duration'] = round(time.monotonic() - result.pop('started'), 3)
+        result['bytes'] = os.path.getsize(result['path']) if result['path'] and os.path.isfile(result['path']) else 0
+        # Linked and skipped items add no bytes: nothing was transferred for them
+        self.metrics.item(status, result['duration'], result['bytes'] if status == 'done' else 0)
+        if status in ('done', 'linked') and result['bytes'] and result.get('id'):
+            record_download(self.index_db, result['id'], self.download_type, self.quality, self.output_path, result['path'])
+        if status == 'done' and result['bytes'] and result.get('store_key'):
+            self.media_store.add(result['store_key'], result['path'])
+        if self.report_file:
+            self.report_file.write(json.dumps({
+                'index': result['index'], 'url': result['url'], 'id': result.get('id'), 'title': result['title'],
+                'status': status, 'path': result['path'], 'bytes': result['bytes'],
+                'duration': result['duration'], 'retries': result.get('retries', 0), 'error': result.get('error'),
+            }) + "\n")
+            self.report_file.flush()
+        # e.g. a --work-from worker marking its queue item done or failed as soon as it is final
+        if self.options['on_result']:
+            self.options['on_result'](dict(result, status=status))
+
+    # Finish an item that never got (or needed) a download slot
+    def finish_early(self, result):
+        self.finish_video(result)
+        return result
+
+    # Take one item through its download slot: skip or link it if it is already there, resolve
+    # its formats, wait for disk space and download it. MP3 sources then go to the transcode stage.
+    async def process_video(self, index, video, resolving):
+        i = index + 1
+        title = video.get('title', 'Unknown Title')
+        position = f"{i}/{self.total_videos or '?'}"
+        base = {'index': i, 'url': video.get('webpage_url') or video.get('url'), 'id': video.get('id'), 'title': title, 'started': time.monotonic()}
+        if video.get('_type') == 'error':
+            console.print(f"[red]❌ Failed to extract {video['url']}: {video['error']}[/red]")
+            return self.finish_early(dict(base, success=False, path=None, error=video['error']))
+        existing = self.already_downloaded(video)
+        if existing:
+            console.print(f"[cyan][=] Skipping video {position}: {title} (already at {existing})[/cyan]")
+            return self.finish_early(dict(base, success=True, skipped=True, path=existing))
+        base['store_key'] = self.media_key(video)
+        linked_path, method = self.place_from_store(video)
+        if linked_path:
+            console.print(f"[cyan][=] Linked video {position}: {title} from the media store ({method})[/cyan]")
+            return self.finish_early(dict(base, success=True, skipped=True, linked=True, path=linked_path))
+        job = self.tracker.add_job(title)
+        if resolving:
+            self.tracker.emit(job, stage='resolve')
+            try:
+                video = await resolving
+            except Exception as e:
+                status = throttle_status(e)
+                if status:
+                    self.metrics.throttle(status)
+                    await self.throttle.report_throttle(throttle_host(video), status)
+                console.print(f"[red]❌ Failed to resolve {title}: {e}[/red]")
+                return self.finish_early(dict(base, success=False, path=None, job=job, error=str(e)))
+            title = video.get('title', title)
+            self.tracker.emit(job, title=title)
+        # One pass over the formats serves both the quality label and the audio choice
+        formats = FormatIndex(video)
+        chosen = formats.pick_audio(self.quality, self.settings['passthrough']) if self.download_type == 'mp3' else None
+        if chosen:
+            bitrate = chosen.get('abr') or chosen.get('tbr')
+            label = f"Audio, {audio_codec(chosen)}" + (f" {round(bitrate)}k" if bitrate else '')
+        elif self.download_type == 'mp3':
+            label = 'Audio'
+        else:
+            label = f"Video at {self.quality if 'formats' not in video else formats.quality_label(self.quality)}"
+        console.print(f"[cyan][+] Processing video {position}: {title} ({label})[/cyan]")
+        # Hold the job back until the volume has room for it
+        try:
+            need = estimate_disk_need(video, self.download_type, chosen)
+            reservation = await self.disk.reserve(self.output_path, need, lambda: self.tracker.emit(job, stage='waiting for disk'))
+            self.reservations[id(reservation)] = reservation
+        except OSError as e:
+            console.print(f"[red]❌ Skipping {title}: {e}[/red]")
+            return self.finish_early(dict(base, title=title, success=False, path=None, job=job, error=str(e)))
+        try:
+            result = await self.download(video, job, chosen)
+        except BaseException:
+            self.disk.release(self.reservations.pop(id(reservation), reservation))
+            raise
+        result = dict(base, title=title, job=job, disk_reservation=reservation, **result)
+        if self.download_type == 'mp3' and result['success'] and result['path']:
+            return await self.queue_transcode(result, video)
+        return self.finish_early(result)
+
+    # Fetch one item through the run's engine, with this job's share of the connection budget
+    async def download(self, video, job, chosen):
+        settings = self.settings
+        job_connections = connections_for_job(settings['connections'], settings['max_connections'], self.connections_in_use, self.workers - self.stages['download']['active'])
+        self.connections_in_use += job_connections
+        self.stages['download']['active'] += 1
+        self.report_stages()
+        job_options = connection_options(job_connections, settings['chunk_size'], settings['range_downloader'])
+        # Workers are shared between items, so the format is set for every job
+        job_options['format'] = chosen['format_id'] if chosen else settings['ydl_opts']['format']
+        progress = {'retries': settings['retries'], 'tracker': self.tracker, 'job': job, 'throttle': self.throttle, 'metrics': self.metrics}
+        try:
+            if settings['engine'] == 'inprocess':
+                worker = await self.ydl_pool.get()
+                try:
+                    return await download_in_process(worker, self.staging_path, video, self.download_type, executor=self.executor, options=job_options, **progress)
+                finally:
+                    self.ydl_pool.put_nowait(worker)
+            job_cookie_file = None
+            if self.cookie_dir:
+                job_cookie_file = os.path.join(self.cookie_dir, f"job{job}.txt")
+                write_cookie_file(self.ydl.cookiejar, job_cookie_file)
+            command = build_download_command(
+                video, self.output_path, self.download_type, self.quality, job_options['format'], self.is_playlist,
+                settings['cookies_browser'], job_options, job_cookie_file, self.staging_path,
+            )
+            try:
+                return await download_with_progress(command, self.staging_path, video, self.download_type, **progress)
+            finally:
+                if job_cookie_file:
+                    with contextlib.suppress(OSError):
+                        os.remove(job_cookie_file)
+        finally:
+            self.stages['download']['active'] -= 1
+            self.connections_in_use -= job_connections
+            self.report_stages()
+
+    # MP3 mode: plan the ffmpeg pass for a downloaded file and hand it to the transcode stage,
+    # which fills in the final path and status on this same dict
+    async def queue_transcode(self, result, video):
+        post = self.settings['post']
+        # Plan from the file that came down; the subprocess engine only has its extension
+        result['audio_plan'] = audio_plan(result['path'], self.quality, self.settings['passthrough'], result.pop('downloaded_format', None), post)
+        if result['audio_plan'][0] == 'keep':
+            # Already in its final form: nothing for ffmpeg to do
+            result.pop('audio_plan')
+            self.metrics.count('passthrough')
+            console.print(f"[green]📦 Kept the original audio of {result['title']} (no transcode)[/green]")
+            return self.finish_early(result)
+        # Tags and artwork go into the same ffmpeg run as the transcode; the cover is
+        # fetched here, in a network slot, rather than in the CPU stage
+        result['audio_post'] = {'tags': audio_tags(video) if post['tags'] else None}
+        if post['cover'] and result['audio_plan'][1] == 'mp3':
+            try:
+                loop = asyncio.get_running_loop()
+                result['audio_post']['cover'] = await loop.run_in_executor(self.executor, fetch_cover, self.ydl, video, result['path'])
+            except Exception as e:
+                console.print(f"[yellow][!] No cover art for {result['title']}: {e}[/yellow]")
+        await self.transcode_queue.put(result)
+        self.report_stages()
+        return result
+
+    # Run every item through the pipeline; returns the results in input order
+    async def execute(self, videos):
+        from rich.live import Live
+        settings = self.settings
+        workers = self.workers
+        if workers > 1:
+            console.print(f"[cyan][+] Running up to {workers} download(s) in parallel[/cyan]")
+        self.throttle = self.throttle or AdaptiveThrottle(workers, settings['rate'], settings['burst'])
+        if self.download_type == 'mp3':
+            console.print(f"[cyan][+] Transcoding to MP3 with up to {settings['transcode_jobs']} ffmpeg process(es)[/cyan]")
+        self.start_workers()
+        self.tracker.set_total(self.total_videos)
+        self.download_queue = asyncio.Queue(maxsize=workers)
+        self.transcode_queue = asyncio.Queue(maxsize=settings['transcode_jobs'] * 2)
+        # Only one rich Live can be active at a time, so background callers (the GUI) opt out
+        if self.options['dashboard']:
+            live = Live(ProgressDashboard(self.tracker), console=console, refresh_per_second=PROGRESS_REFRESH_PER_SECOND)
+        else:
+            live = contextlib.nullcontext()
+        with live:
+            transcoders = [
+                asyncio.ensure_future(transcode_worker(
+                    self.transcode_queue, self.quality, self.stages['transcode'], self.report_stages, self.finish_video,
+                    self.tracker, self.metrics, settings['post'], self.index_db,
+                ))
+                for _ in range(settings['transcode_jobs'])
+            ]
+            try:
+                prepare = self.resolve_video if self.stream and settings['engine'] == 'inprocess' else None
+                results = await run_download_pool(videos, self.process_video, workers, prepare=prepare, executor=self.executor, on_total=self.set_total, queue=self.download_queue)
+                for _ in transcoders:
+                    await self.transcode_queue.put(None)
+                await asyncio.gather(*transcoders)
+                self.report_stages()
+            finally:
+                for transcoder in transcoders:
+                    transcoder.cancel()
+                # Items dropped by a cancelled or failed run never reach finish_video
+                for reservation in self.reservations.values():
+                    self.disk.release(reservation)
+                self.reservations.clear()
+                self.close_workers()
+        return results
+
+    # Print the end-of-run report: per-item table, totals and where the time went
+    def summarize(self, results):
+        from rich.table import Table
+        total_videos = len(results)
+        success_count = sum(1 for result in results if result['success'])
+        if total_videos > 1 and self.options['batch_urls'] is None:
+            report = Table(title="Download Report", border_style="cyan")
+            report.add_column("#", justify="right")
+            report.add_column("Title")
+            report.add_column("Status")
+            for i, result in enumerate(results, 1):
+                if result.get('linked'):
+                    status = "[cyan]🔗 Linked[/cyan]"
+                elif result.get('skipped'):
+                    status = "[cyan]⏭️ Up to date[/cyan]"
                 else:
-                    command.append('--no-playlist')
-                success = await download_with_progress(command, output_path, video, download_type, status_label=status_label)
-                if success:
-                    success_count += 1
-            console.print(f"\n[green]✅ Completed: {success_count}/{total_videos} downloads successful![/green]")
-            if status_label and success_count == total_videos:
-                status_label.config(text="All downloads complete!", **({'bootstyle': "success"} if USE_TTKBOOTSTRAP else {'foreground': "green"}))
+                    status = "[green]✅ Done[/green]" if result['success'] else "[red]❌ Failed[/red]"
+                report.add_row(str(i), result['title'], status)
+            console.print(report)
+        skipped_count = sum(1 for result in results if result.get('skipped'))
+        console.print(f"\n[green]✅ Completed: {success_count}/{total_videos} downloads successful!{f' ({skipped_count} already up to date)' if skipped_count else ''}[/green]")
+        stage_times = self.metrics.summary()['stages']
+        timings = ', '.join(f"{stage} {stage_times[stage]['total_seconds']:.1f}s" for stage in ('extract', 'resolve', 'download', 'retry_wait', 'loudness', 'transcode', 'remux', 'link') if stage in stage_times)
+        if timings:
+            console.print(f"[cyan][=] Time by stage (summed across workers): {timings}[/cyan]")
+        throttle = self.throttle
+        if throttle.throttled:
+            console.print(f"[yellow][!] Upstream throttled {throttle.throttled} request(s); concurrency ended at {int(throttle.limit)}/{throttle.max_concurrency}[/yellow]")
+        if self.options['report_path']:
+            console.print(f"[cyan][+] Wrote results for {total_videos} item(s) to {self.options['report_path']}[/cyan]")
+
+# Main download function. `options` are the DOWNLOAD_OPTIONS; whatever isn't given comes from config.ini.
+async def download_media(url, is_playlist, output_path, download_type, quality, **options):
+    import yt_dlp
+    unknown = set(options) - set(DOWNLOAD_OPTIONS)
+    if unknown:
+        raise TypeError(f"download_media() got unknown option(s): {', '.join(sorted(unknown))}")
+    options = dict(DOWNLOAD_OPTIONS, **options)
+    console.print(f"\n[yellow][+] Preparing download for {url or 'batch'}...[/yellow]\n")
+    settings = load_run_settings(output_path, download_type, quality, is_playlist, options)
+    run = DownloadRun(output_path, download_type, is_playlist, settings, options)
+    warm, ydl_opts = options['warm'], settings['ydl_opts']
+    try:
+        # With a warm pool (daemon mode) instances outlive this run instead of being closed
+        with (contextlib.nullcontext(warm.take(ydl_opts, session=settings['cookies_browser'])) if warm else yt_dlp.YoutubeDL(ydl_opts)) as ydl:
+            run.attach(ydl)
+            videos = await run.list_videos(url)
+            results = await run.execute(videos)
+        run.summarize(results)
+        return results
     except Exception as e:
         console.print(f"[red]❌ Error: {e}[/red]")
-        if status_label:
-            status_label.config(text=f"Error: {e}", **({'bootstyle': "danger"} if USE_TTKBOOTSTRAP else {'foreground': "red"}))
-
-def get_actual_quality(video_info, selected_quality):
-    if selected_quality == 'best':
-        return 'best'
-    quality_map = {'4K': 2160, '2K': 1440, '1080p': 1080, '720p': 720, '480p': 480, '360p': 360, '144p': 144}
-    selected_height = quality_map.get(selected_quality, 2160)
-    available_formats = video_info.get('formats', [])
-    max_height = 0
-    for fmt in available_formats:
-        height = fmt.get('height', 0)
-        if height and height <= selected_height and height > max_height:
-            max_height = height
-    for q, h in quality_map.items():
-        if max_height >= h:
-            return q
-    return '144p'  # Fallback to lowest if no match
+    finally:
+        run.close()
+
+# Per-job options accepted by the --serve API, mirroring the CLI flags, and the JSON type each takes
+JOB_OPTIONS = {
+    'type': str, 'quality': str, 'output': str, 'engine': str, 'chunk_size': str,
+    'playlist': bool, 'sync': bool, 'refresh': bool, 'stream': bool, 'store': bool, 'passthrough': bool, 'normalize': bool, 'tags': bool,
+    'jobs': int, 'transcode_jobs': int, 'connections': int, 'retries': int, 'rate': (int, float),
+}
+JOB_OPTION_TYPE_NAMES = {str: "a string", bool: "true or false", int: "an integer", (int, float): "a number"}
+
+# Check one job submitted to the API before it is queued; raises ValueError naming the bad field
+def validate_job_spec(spec):
+    if not isinstance(spec, dict):
+        raise ValueError("Every job must be a JSON object")
+    if not spec.get('url') or not isinstance(spec['url'], str):
+        raise ValueError("Every job needs a url")
+    unknown = set(spec) - set(JOB_OPTIONS) - {'url'}
+    if unknown:
+        raise ValueError(f"Unknown option(s): {', '.join(sorted(unknown))}")
+    for key, value in spec.items():
+        if key == 'url':
+            continue
+        expected = JOB_OPTIONS[key]
+        # bool is an int subclass, but "jobs": true is not a count
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            raise ValueError(f"Option '{key}' must be {JOB_OPTION_TYPE_NAMES[expected]}")
+    if spec.get('type', 'mp3') not in ('mp3', 'video'):
+        raise ValueError("Option 'type' must be 'mp3' or 'video'")
+    if spec.get('engine', ENGINES[0]) not in ENGINES:
+        raise ValueError(f"Option 'engine' must be one of: {', '.join(ENGINES)}")
+    for key in ('jobs', 'transcode_jobs', 'connections', 'retries'):
+        if spec.get(key, 1) < 1:
+            raise ValueError(f"Option '{key}' must be at least 1")
+    if spec.get('rate', 0) < 0:
+        raise ValueError("Option 'rate' must be 0 (no limit) or more")
+
+# SQLite-backed queue of daemon jobs. Submissions are committed before they are acknowledged,
+# and jobs that were running when the daemon stopped go back to 'queued' on the next start.
+class JobQueue:
+    def __init__(self, path=JOBS_DB):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                options TEXT NOT NULL,
+                status TEXT NOT NULL,
+                summary TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            self.conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+
+    def _row(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['options'] = json.loads(job['options'])
+        return job
+
+    def enqueue(self, url, options):
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "INSERT INTO jobs (url, options, status, created_at) VALUES (?, ?, 'queued', ?)",
+                (url, json.dumps(options), now)
+            ).lastrowid
+
+    # Move the oldest queued job to 'running' and return it
+    def claim(self):
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (now, row['id']))
+        job = self._row(row)
+        job.update(status='running', started_at=now)
+        return job
+
+    def finish(self, job_id, status, summary):
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, summary = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(summary), now, job_id)
+            )
+
+    # Cancel a job that has not started yet; returns False if it is no longer queued
+    def cancel_queued(self, job_id):
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.conn:
+            cursor = self.conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'", (now, job_id))
+        return cursor.rowcount > 0
+
+    def get(self, job_id):
+        with self.lock:
+            job = self._row(self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        if job and job['summary']:
+            job['summary'] = json.loads(job['summary'])
+        return job
+
+    def list(self, status=None, limit=100):
+        query = "SELECT id, url, status, created_at, started_at, finished_at FROM jobs"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# Default lease on a shared work queue item; workers renew it every third of this while they work
+DEFAULT_LEASE_SECONDS = 120
+
+# A work item whose lease runs out this many times (its workers keep crashing) is marked failed
+MAX_LEASE_ATTEMPTS = 3
+
+# Interface of the shared work queues behind --enqueue-to / --work-from. Items are flat playlist
+# entries plus the download options they were enqueued with. Workers claim them under a
+# time-limited lease, renew the lease while they work and complete them as done or failed;
+# an item whose lease expires goes back to the queue for another worker.
+class WorkQueue(ABC):
+    # Add entries with their options; returns how many were new (or failed, and queued again)
+    @abstractmethod
+    def enqueue(self, entries, options):
+        pass
+
+    # Lease the oldest queued item (with exactly these options, if given) to `worker`, or None
+    @abstractmethod
+    def claim(self, worker, lease_seconds, options=None):
+        pass
+
+    # Extend the leases `worker` holds on these items; returns the IDs it no longer holds
+    @abstractmethod
+    def renew(self, worker, item_ids, lease_seconds):
+        pass
+
+    # Record the outcome of an item, if `worker` still holds it
+    @abstractmethod
+    def complete(self, item_id, worker, status, result):
+        pass
+
+    # Hand leased items back without counting an attempt against them
+    @abstractmethod
+    def release(self, worker, item_ids):
+        pass
+
+    # Number of items per status
+    @abstractmethod
+    def counts(self):
+        pass
+
+    def close(self):
+        pass
+
+# SQLite work queue for a file on shared storage. It keeps the default rollback journal, since WAL
+# needs shared memory that network filesystems don't provide, and takes the write lock up front
+# (BEGIN IMMEDIATE) for every change. Lease times are wall-clock, so hosts need synced clocks.
+class SQLiteWorkQueue(WorkQueue):
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self._transaction():
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS work_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                item_key TEXT NOT NULL,
+                options TEXT NOT NULL,
+                entry TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                updated_at TEXT NOT NULL,
+                UNIQUE (item_key, options)
+            )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS work_items_status ON work_items (status, id)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def enqueue(self, entries, options):
+        options = json.dumps(options, sort_keys=True)
+        now = datetime.now().isoformat(timespec='seconds')
+        added = 0
+        # One transaction (and one fsync on shared storage) per batch rather than per entry
+        with self._transaction():
+            for entry in entries:
+                key = f"{entry.get('ie_key') or entry.get('extractor_key', '')}:{entry['id']}" if entry.get('id') else normalize_url(entry.get('webpage_url') or entry.get('url', ''))
+                # Enqueueing again is a no-op for known items, and puts failed ones back in the queue
+                cursor = self.conn.execute(
+                    """INSERT INTO work_items (item_key, options, entry, status, updated_at) VALUES (?, ?, ?, 'queued', ?)
+                    ON CONFLICT (item_key, options) DO UPDATE SET status = 'queued', attempts = 0, result = NULL, updated_at = excluded.updated_at
+                    WHERE status = 'failed'""",
+                    (key, options, json.dumps(entry, default=str), now)
+                )
+                added += cursor.rowcount
+        return added
+
+    def claim(self, worker, lease_seconds, options=None):
+        now = time.time()
+        stamp = datetime.now().isoformat(timespec='seconds')
+        with self._transaction():
+            # Leases that ran out belong to crashed or stuck workers: queue their items again
+            self.conn.execute(
+                "UPDATE work_items SET status = 'failed', worker = NULL, result = ?, updated_at = ? WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (json.dumps({'error': f"Lease expired {MAX_LEASE_ATTEMPTS} times"}), stamp, now, MAX_LEASE_ATTEMPTS)
+            )
+            self.conn.execute("UPDATE work_items SET status = 'queued', worker = NULL, updated_at = ? WHERE status = 'leased' AND lease_expires < ?", (stamp, now))
+            if options is None:
+                row = self.conn.execute("SELECT * FROM work_items WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            else:
+                row = self.conn.execute("SELECT * FROM work_items WHERE status = 'queued' AND options = ? ORDER BY id LIMIT 1", (json.dumps(options, sort_keys=True),)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE work_items SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker, now + lease_seconds, stamp, row['id'])
+            )
+        return {'id': row['id'], 'entry': json.loads(row['entry']), 'options': json.loads(row['options']), 'attempts': row['attempts'] + 1}
+
+    def renew(self, worker, item_ids, lease_seconds):
+        if not item_ids:
+            return []
+        marks = ','.join('?' * len(item_ids))
+        with self._transaction():
+            self.conn.execute(f"UPDATE work_items SET lease_expires = ? WHERE status = 'leased' AND worker = ? AND id IN ({marks})", (time.time() + lease_seconds, worker, *item_ids))
+            held = {row[0] for row in self.conn.execute(f"SELECT id FROM work_items WHERE status = 'leased' AND worker = ? AND id IN ({marks})", (worker, *item_ids))}
+        return [item_id for item_id in item_ids if item_id not in held]
+
+    def complete(self, item_id, worker, status, result):
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE work_items SET status = ?, worker = NULL, lease_expires = NULL, result = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (status, json.dumps(result, default=str), datetime.now().isoformat(timespec='seconds'), item_id, worker)
+            )
+
+    def release(self, worker, item_ids):
+        if not item_ids:
+            return
+        marks = ','.join('?' * len(item_ids))
+        with self._transaction():
+            self.conn.execute(
+                f"UPDATE work_items SET status = 'queued', worker = NULL, lease_expires = NULL, attempts = attempts - 1 WHERE status = 'leased' AND worker = ? AND id IN ({marks})",
+                (worker, *item_ids)
+            )
+
+    def counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM work_items GROUP BY status").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# Work queue backends by URL scheme (e.g. sqlite:///mnt/shared/queue.db); a plain path means SQLite
+WORK_QUEUE_BACKENDS = {'sqlite': SQLiteWorkQueue}
+
+def open_work_queue(spec):
+    scheme, separator, location = spec.partition('://')
+    if not separator:
+        return SQLiteWorkQueue(spec)
+    if scheme not in WORK_QUEUE_BACKENDS:
+        raise ValueError(f"Unknown work queue backend '{scheme}' (available: {', '.join(sorted(WORK_QUEUE_BACKENDS))})")
+    return WORK_QUEUE_BACKENDS[scheme](location)
+
+# Long-running download service: claims jobs from the queue and runs up to max_jobs of them
+# at once on a background loop. All jobs share warm YoutubeDL instances and one throttle.
+class DownloadDaemon:
+    def __init__(self, queue, max_jobs):
+        self.queue = queue
+        self.max_jobs = max_jobs
+        self.loop = start_background_loop()
+        self.warm = YoutubeDLPool()
+        # Changed on the loop thread and read from the API's request threads
+        self.running = {}
+        self.running_lock = threading.Lock()
+        self.wakeup = None
+        self.throttle = None
+        self.disk = None
+        # Totals over the daemon's lifetime, served at GET /metrics
+        self.metrics = RunMetrics()
+
+    def start(self):
+        asyncio.run_coroutine_threadsafe(self._dispatch(), self.loop)
+
+    def submit(self, url, options):
+        job_id = self.queue.enqueue(url, options)
+        self.loop.call_soon_threadsafe(self._wake)
+        return job_id
+
+    def cancel(self, job_id):
+        if self.queue.cancel_queued(job_id):
+            return True
+        with self.running_lock:
+            future, tracker = self.running.get(job_id, (None, None))
+        if future is None:
+            return False
+        tracker.cancel()
+        self.loop.call_soon_threadsafe(future.cancel)
+        return True
+
+    # Live progress for a running job, None otherwise
+    def progress(self, job_id):
+        with self.running_lock:
+            future, tracker = self.running.get(job_id, (None, None))
+        return tracker.snapshot() if tracker else None
+
+    # IDs of the running jobs, for /health
+    def running_ids(self):
+        with self.running_lock:
+            return sorted(self.running)
+
+    def _wake(self):
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def _dispatch(self):
+        self.wakeup = asyncio.Event()
+        self.disk = DiskBudget(load_min_free_space())
+        self.throttle = AdaptiveThrottle(max(load_settings()[2], self.max_jobs), float(load_config().get('requests_per_second', DEFAULT_REQUESTS_PER_SECOND)), int(load_config().get('burst', DEFAULT_BURST)))
+        while True:
+            while len(self.running) < self.max_jobs:
+                job = self.queue.claim()
+                if job is None:
+                    break
+                tracker = ProgressTracker()
+                with self.running_lock:
+                    self.running[job['id']] = (asyncio.ensure_future(self._run(job, tracker)), tracker)
+            self.wakeup.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.wakeup.wait(), 5)
+
+    async def _run(self, job, tracker):
+        options = job['options']
+        download_type = options.get('type', 'mp3')
+        console.print(f"[cyan][+] Job {job['id']}: starting {job['url']}[/cyan]")
+        status, summary = 'failed', {}
+        metrics = RunMetrics(self.metrics)
+        try:
+            # Tuning options the job leaves out keep download_media's defaults
+            tuning = {key: value for key, value in options.items() if key in DOWNLOAD_OPTIONS}
+            results = await download_media(
+                job['url'], options.get('playlist', False), normalize_output_path(options.get('output'), download_type),
+                download_type, options.get('quality'), tracker=tracker, dashboard=False,
+                disk=self.disk, warm=self.warm, throttle=self.throttle, metrics=metrics, **tuning,
+            )
+            if results is None:
+                summary = {'error': "Error during extraction"}
+            else:
+                succeeded = sum(1 for result in results if result['success'])
+                status = 'done' if succeeded == len(results) else 'failed'
+                summary = {
+                    'succeeded': succeeded,
+                    'failed': len(results) - succeeded,
+                    'items': [{key: result.get(key) for key in ('id', 'title', 'success', 'skipped', 'path', 'bytes', 'error')} for result in results],
+                    'metrics': metrics.summary(),
+                }
+        except asyncio.CancelledError:
+            status, summary = 'cancelled', {}
+        except Exception as e:
+            summary = {'error': str(e)}
+        finally:
+            self.queue.finish(job['id'], status, summary)
+            with self.running_lock:
+                self.running.pop(job['id'], None)
+            self._wake()
+        console.print(f"[{'green' if status == 'done' else 'red'}][+] Job {job['id']}: {status}[/{'green' if status == 'done' else 'red'}]")
+
+# Build the HTTP handler for the daemon API. http.server is imported here so that other modes
+# don't pay for it at startup.
+#   POST   /jobs               {"url": ..., options...} or {"jobs": [...]}  -> {"ids": [...]}
+#   GET    /jobs?status=&limit= list jobs, newest first
+#   GET    /jobs/<id>          job record, plus live progress while running
+#   GET    /jobs/<id>/events   newline-delimited JSON progress until the job finishes
+#   DELETE /jobs/<id>          cancel (also POST /jobs/<id>/cancel)
+#   GET    /health             queue counts and running jobs
+#   GET    /metrics            Prometheus text: stage timings and counters since the daemon started
+def make_api_handler(daemon):
+    from http.server import BaseHTTPRequestHandler
+
+    class ApiHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def route(self):
+            parts = urlsplit(self.path)
+            segments = [segment for segment in parts.path.split('/') if segment]
+            job_id = int(segments[1]) if len(segments) > 1 and segments[0] == 'jobs' and segments[1].isdigit() else None
+            return segments, job_id, dict(parse_qsl(parts.query))
+
+        def do_GET(self):
+            segments, job_id, query = self.route()
+            if segments == ['health']:
+                self.send_json(200, {'queue': daemon.queue.counts(), 'running': daemon.running_ids()})
+            elif segments == ['metrics']:
+                body = daemon.metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif segments == ['jobs']:
+                limit = query.get('limit', '100')
+                if not limit.isdigit():
+                    self.send_json(400, {'error': "limit must be a non-negative integer"})
+                    return
+                self.send_json(200, {'jobs': daemon.queue.list(query.get('status'), int(limit))})
+            elif job_id is not None and len(segments) == 2:
+                job = daemon.queue.get(job_id)
+                if job is None:
+                    self.send_json(404, {'error': "No such job"})
+                    return
+                job['progress'] = daemon.progress(job_id)
+                self.send_json(200, job)
+            elif job_id is not None and segments[2:] == ['events']:
+                self.stream_events(job_id)
+            else:
+                self.send_json(404, {'error': "Not found"})
+
+        # Chunked NDJSON at the dashboard refresh rate, ending with the final job record
+        def stream_events(self, job_id):
+            if daemon.queue.get(job_id) is None:
+                self.send_json(404, {'error': "No such job"})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                while True:
+                    job = daemon.queue.get(job_id)
+                    finished = job['status'] not in ('queued', 'running')
+                    event = job if finished else {'id': job_id, 'status': job['status'], 'progress': daemon.progress(job_id)}
+                    line = json.dumps(event, default=str).encode() + b"\n"
+                    self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                    self.wfile.flush()
+                    if finished:
+                        break
+                    time.sleep(1 / PROGRESS_REFRESH_PER_SECOND)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_POST(self):
+            segments, job_id, query = self.route()
+            if job_id is not None and segments[2:] == ['cancel']:
+                self.cancel(job_id)
+                return
+            if segments != ['jobs']:
+                self.send_json(404, {'error': "Not found"})
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                # {"jobs": [...]} is a batch; a job with a url may also set its own "jobs" (parallel downloads)
+                specs = payload['jobs'] if isinstance(payload, dict) and 'jobs' in payload and 'url' not in payload else [payload]
+                if not isinstance(specs, list):
+                    raise ValueError("'jobs' must be a list")
+                for spec in specs:
+                    validate_job_spec(spec)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            ids = [daemon.submit(spec['url'], {key: value for key, value in spec.items() if key != 'url'}) for spec in specs]
+            self.send_json(201, {'ids': ids})
+
+        def do_DELETE(self):
+            segments, job_id, query = self.route()
+            if job_id is None or len(segments) != 2:
+                self.send_json(404, {'error': "Not found"})
+                return
+            self.cancel(job_id)
+
+        def cancel(self, job_id):
+            if daemon.cancel(job_id):
+                self.send_json(200, {'id': job_id, 'cancelled': True})
+            else:
+                self.send_json(409, {'id': job_id, 'cancelled': False, 'error': "Job is not queued or running"})
+
+    return ApiHandler
+
+# Run the download daemon until interrupted
+def serve_main(listen, max_jobs):
+    from http.server import ThreadingHTTPServer
+    host, _, port = listen.rpartition(':')
+    queue = JobQueue()
+    daemon = DownloadDaemon(queue, max_jobs)
+    server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), make_api_handler(daemon))
+    server.daemon_threads = True
+    daemon.start()
+    counts = queue.counts()
+    console.print(f"[green][+] Serving the download API on http://{host or '127.0.0.1'}:{server.server_address[1]} ({max_jobs} job(s) at a time, {counts.get('queued', 0)} queued from before)[/green]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        # Running jobs stay 'running' in the queue and are picked up again on the next start
+        console.print("\n[yellow][!] Shutting down; running jobs will be resumed on the next start[/yellow]")
+    finally:
+        server.server_close()
+
+# Enumerate URLs (playlists are expanded without resolving their entries) into a shared work
+# queue, tagged with the download options every worker will use for them
+def enqueue_media(queue_spec, urls, is_playlist, options):
+    import yt_dlp
+    work_queue = open_work_queue(queue_spec)
+    cache = load_metadata_cache()
+    config = load_config()
+    cookies_browser = config.get('cookies_browser', 'firefox')
+    added = errors = 0
+    try:
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'noplaylist': not is_playlist}) as ydl:
+            if cookies_browser.lower() != 'none':
+                ydl.__dict__['cookiejar'] = load_browser_cookies(cookies_browser, int(config.get('cookie_ttl', DEFAULT_COOKIE_TTL)), config.get('cookie_cache_file') or None, ydl)
+            console.print(f"[yellow][+] Enumerating into the work queue at {queue_spec}...[/yellow]")
+            batch = []
+            for entry in iter_batch_entries(ydl, urls, cache):
+                if entry.get('_type') == 'error':
+                    console.print(f"[red]❌ Failed to extract {entry['url']}: {entry['error']}[/red]")
+                    errors += 1
+                    continue
+                batch.append(ydl.sanitize_info(entry))
+                # Commit in chunks so workers can start on a huge channel while it is still being listed
+                if len(batch) >= 100:
+                    added += work_queue.enqueue(batch, options)
+                    batch = []
+            added += work_queue.enqueue(batch, options)
+        counts = work_queue.counts()
+        console.print(f"[green]✅ Added {added} item(s) to the work queue ({counts.get('queued', 0)} queued, {counts.get('leased', 0)} in progress, {counts.get('done', 0)} done, {counts.get('failed', 0)} failed)[/green]")
+    finally:
+        work_queue.close()
+    return added, errors
+
+# Work through a shared queue until it is drained: claim items under a lease, download them with
+# download_media (one run per distinct set of enqueued options), renew the leases while the run
+# works and complete each item as soon as it is final. Items leased by other workers are waited
+# for, so a crashed worker's items are picked up once their leases run out.
+async def work_from_queue(queue_spec, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS, output_path=None, **download_options):
+    loop = asyncio.get_running_loop()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    work_queue = open_work_queue(queue_spec)
+    totals = {'done': 0, 'failed': 0}
+    console.print(f"[yellow][+] Worker {worker_id} taking items from {queue_spec} (lease {lease_seconds}s)[/yellow]")
+    try:
+        while True:
+            first = await loop.run_in_executor(None, work_queue.claim, worker_id, lease_seconds)
+            if first is None:
+                counts = await loop.run_in_executor(None, work_queue.counts)
+                if not counts.get('leased'):
+                    break
+                # Someone else holds the rest; wait until they finish or their leases run out
+                await asyncio.sleep(min(lease_seconds / 4, 15))
+                continue
+            options = first['options']
+            claimed = [first]
+            reported = set()
+            completing = []
+
+            # Claimed lazily on download_media's producer thread, so at most a few items are held ahead
+            def entries():
+                yield first['entry']
+                while True:
+                    item = work_queue.claim(worker_id, lease_seconds, options)
+                    if item is None:
+                        return
+                    claimed.append(item)
+                    yield item['entry']
+
+            # Queue item behind a result; None for results with no item, such as a claim() that failed
+            # mid-listing and ended the entries early
+            def claimed_item(result):
+                return claimed[result['index'] - 1] if 0 < result['index'] <= len(claimed) else None
+
+            # Runs on the event loop; the write to the queue (which may wait on a busy database) doesn't
+            def on_result(result):
+                item = claimed_item(result)
+                if item is None:
+                    return
+                status = 'failed' if result['status'] == 'failed' else 'done'
+                completing.append((item['id'], loop.run_in_executor(None, work_queue.complete, item['id'], worker_id, status, {key: result.get(key) for key in ('status', 'path', 'bytes', 'duration', 'error')})))
+                reported.add(item['id'])
+                totals[status] += 1
+
+            async def heartbeat():
+                while True:
+                    await asyncio.sleep(lease_seconds / 3)
+                    held = [item['id'] for item in list(claimed) if item['id'] not in reported]
+                    lost = await loop.run_in_executor(None, work_queue.renew, worker_id, held, lease_seconds)
+                    if lost:
+                        console.print(f"[yellow][!] Lost the lease on {len(lost)} item(s); another worker may download them too[/yellow]")
+
+            beat = asyncio.ensure_future(heartbeat())
+            try:
+                download_type = options.get('type', 'mp3')
+                results = await download_media(
+                    None, False, output_path or normalize_output_path(options.get('output'), download_type), download_type, options.get('quality'),
+                    entries=entries(), passthrough=options.get('passthrough'), normalize=options.get('normalize'), tags=options.get('tags'), on_result=on_result, **download_options
+                )
+                # Items that errored outside the normal finish path still get a final status
+                for result in results or []:
+                    item = claimed_item(result)
+                    if item and item['id'] not in reported:
+                        on_result(dict(result, status='failed'))
+            finally:
+                beat.cancel()
+                outcomes = await asyncio.gather(*(future for _, future in completing), return_exceptions=True)
+                for (item_id, _), outcome in zip(completing, outcomes):
+                    if isinstance(outcome, Exception):
+                        # Released below instead, so another attempt can pick it up
+                        console.print(f"[red]❌ Could not record the result of item {item_id} in the work queue: {outcome}[/red]")
+                        reported.discard(item_id)
+                # Whatever was claimed but never finished (an error or Ctrl+C) goes straight back
+                unfinished = [item['id'] for item in claimed if item['id'] not in reported]
+                await loop.run_in_executor(None, work_queue.release, worker_id, unfinished)
+            if results is None:
+                break
+        counts = work_queue.counts()
+        console.print(f"[green]✅ Worker {worker_id}: {totals['done']} done, {totals['failed']} failed; queue has {counts.get('queued', 0)} queued, {counts.get('done', 0)} done, {counts.get('failed', 0)} failed[/green]")
+    finally:
+        work_queue.close()
+    return totals
+
+# Write the run's metrics as Prometheus text and/or a JSON summary
+def export_metrics(metrics, prometheus_path=None, json_path=None):
+    if prometheus_path:
+        write_text_atomic(prometheus_path, metrics.prometheus())
+        console.print(f"[cyan][+] Wrote Prometheus metrics to {prometheus_path}[/cyan]")
+    if json_path:
+        write_text_atomic(json_path, json.dumps(metrics.summary(), indent=2) + "\n")
+        console.print(f"[cyan][+] Wrote the metrics summary to {json_path}[/cyan]")
+
+# Run `main` under cProfile, save the stats and print the hottest call sites. Only the calling
+# thread is profiled: the event loop and orchestration, not yt-dlp work on executor threads.
+def run_profiled(main, profile_path, limit=15):
+    import cProfile
+    import io
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(main)
+    finally:
+        profiler.dump_stats(profile_path)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+        console.print(stream.getvalue(), markup=False, highlight=False)
+        console.print(f"[cyan][+] Saved the profile to {profile_path} (open with: python -m pstats {profile_path})[/cyan]")
 
 # Parse command-line arguments
 def parse_args():
@@ -523,26 +3365,116 @@ def parse_args():
     parser.add_argument('--output', default=None, help="Output directory (e.g., /home/username/songs or /videos)")
     parser.add_argument('--playlist', action='store_true', help="Download as playlist")
     parser.add_argument('--gui', action='store_true', help="Launch GUI interface")
+    parser.add_argument('--serve', action='store_true', help=f"Run as a daemon with a local HTTP API and a durable job queue ({JOBS_DB})")
+    parser.add_argument('--listen', default=DEFAULT_LISTEN, help=f"Address for --serve as HOST:PORT (default: {DEFAULT_LISTEN})")
+    parser.add_argument('--enqueue-to', default=None, metavar='QUEUE', help="Enumerate --url/--batch-file into a shared work queue (a SQLite file on shared storage, or BACKEND://LOCATION) instead of downloading")
+    parser.add_argument('--work-from', default=None, metavar='QUEUE', help="Run as a worker: download items from a shared work queue until it is drained (start as many as you like, on any host)")
+    parser.add_argument('--worker-id', default=None, help="Name of this worker in the work queue (default: HOST:PID)")
+    parser.add_argument('--lease', type=int, default=DEFAULT_LEASE_SECONDS, help=f"Seconds a worker holds a work queue item without renewing it; expired items go back to the queue (default: {DEFAULT_LEASE_SECONDS})")
+    parser.add_argument('--batch-file', default=None, help="File with one URL per line ('-' reads stdin); all URLs share one worker pool")
+    parser.add_argument('--report', default=None, help="Write a JSONL results report here (default for --batch-file: batch_report.jsonl)")
+    parser.add_argument('--jobs', type=int, default=None, help="Max parallel downloads (overrides max_parallel in config.ini)")
+    parser.add_argument('--sync', action='store_true', help="Only fetch items that are not already downloaded (checked against the download index and disk)")
+    parser.add_argument('--no-store', action='store_true', help="Don't link from or add to the media store for this run")
+    parser.add_argument('--gc', action='store_true', help="Delete media store objects that no output file references any more, then exit")
+    parser.add_argument('--refresh', action='store_true', help="Ignore cached metadata and re-extract everything")
+    parser.add_argument('--passthrough', action='store_true', default=None, help="MP3 mode: keep Opus/AAC/MP3 audio as it is (stream-copied) instead of re-encoding (default: audio_passthrough in config.ini)")
+    parser.add_argument('--normalize', action='store_true', default=None, help="MP3 mode: two-pass EBU R128 loudness normalization to loudnorm_target (default -14 LUFS), cached by video ID (default: loudnorm in config.ini)")
+    parser.add_argument('--no-tags', dest='tags', action='store_false', default=None, help="MP3 mode: don't write ID3 tags and cover art (default: embed_metadata / embed_thumbnail in config.ini)")
+    parser.add_argument('--min-free-space', default=None, help=f"Free space to leave on the output volume; downloads wait while their expected sizes would cut into it (default: min_free_space in config.ini, else {DEFAULT_MIN_FREE_SPACE})")
+    parser.add_argument('--no-stream', action='store_true', help="Resolve the whole playlist before downloading instead of streaming entries")
+    parser.add_argument('--transcode-jobs', type=int, default=None, help="Max parallel ffmpeg transcodes in MP3 mode (default: transcode_workers in config.ini, else CPU count)")
+    parser.add_argument('--engine', choices=ENGINES, default=None, help="Download engine: inprocess (default) or subprocess")
+    parser.add_argument('--connections', type=int, default=None, help=f"Max parallel fragment/range requests per download (default: connections in config.ini, else {DEFAULT_CONNECTIONS})")
+    parser.add_argument('--max-connections', type=int, default=None, help=f"Connection budget shared by all running downloads (default: max_connections in config.ini, else {DEFAULT_MAX_CONNECTIONS})")
+    parser.add_argument('--chunk-size', default=None, help=f"HTTP chunk size for range requests, e.g. 10M; 0 disables (default: chunk_size in config.ini, else {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('--range-downloader', choices=RANGE_DOWNLOADERS, default=None, help="Downloader for plain HTTP formats: native, or aria2c for multi-connection ranges")
+    parser.add_argument('--rate', type=float, default=None, help=f"Max download starts and format resolutions per second per host; 0 for no limit (default: requests_per_second in config.ini, else {DEFAULT_REQUESTS_PER_SECOND:g})")
+    parser.add_argument('--retries', type=int, default=None, help=f"Attempts per video, with exponential backoff between them (default: retries in config.ini, else {DEFAULT_RETRIES})")
+    parser.add_argument('--metrics-file', default=None, help="Write Prometheus-format stage timings and counters here at the end of the run (--serve exposes them at /metrics)")
+    parser.add_argument('--metrics-json', default=None, help="Write a JSON summary of stage timings (count, total, p50, p95, max) and counters here at the end of the run")
+    parser.add_argument('--profile', nargs='?', const='profile.prof', default=None, metavar='FILE', help="Profile the orchestrator with cProfile and save the stats (default file: profile.prof)")
+    parser.add_argument('--non-interactive', action='store_true', help="Never prompt: exit if a required dependency is missing (implied when stdin is not a terminal)")
+    parser.add_argument('--recheck-deps', action='store_true', help=f"Ignore {DEPENDENCY_CACHE_FILE} and probe every dependency again")
     return parser.parse_args()
 
 # Run everything
 if __name__ == "__main__":
-    # Clear dependency cache to ensure fresh checks
-    DEPENDENCY_CACHE.clear()
-    # Dependency checks
+    args = parse_args()
+    if args.gc:
+        media_store = load_media_store()
+        if media_store is None:
+            console.print("[yellow][!] The media store is disabled (store_dir=none).[/yellow]")
+            sys.exit(0)
+        removed, freed = media_store.gc()
+        media_store.close()
+        console.print(f"[green]✅ Media store: removed {removed} unreferenced object(s), freed {format_bytes(freed)}[/green]")
+        sys.exit(0)
+    interactive = not args.non_interactive and sys.stdin.isatty()
+    # Reuse the previous launch's checks unless the interpreter or PATH changed
+    if not args.recheck_deps:
+        load_dependency_cache()
     dependencies = [
         ('yt-dlp', f'{sys.executable} -m pip install yt-dlp', True),
         ('ffmpeg', 'sudo apt install ffmpeg -y', False),
         ('rich', f'{sys.executable} -m pip install rich', True),
-        ('ttkbootstrap', f'{sys.executable} -m pip install ttkbootstrap', True)
     ]
+    # ttkbootstrap only matters when the GUI can be reached (--gui or the interactive menu)
+    if args.gui or not (args.url or args.batch_file or args.serve or args.work_from):
+        dependencies.append(('ttkbootstrap', f'{sys.executable} -m pip install ttkbootstrap', True))
     for pkg, cmd, is_pip in dependencies:
-        check_and_install(pkg, cmd, is_pip)
-    args = parse_args()
+        check_and_install(pkg, cmd, is_pip, interactive=interactive, optional=pkg == 'ttkbootstrap')
+    save_dependency_cache()
+    if args.jobs is not None and args.jobs < 1:
+        console.print("[red]⚠️ --jobs must be at least 1.[/red]")
+        sys.exit(1)
+    if args.transcode_jobs is not None and args.transcode_jobs < 1:
+        console.print("[red]⚠️ --transcode-jobs must be at least 1.[/red]")
+        sys.exit(1)
+    if args.rate is not None and args.rate < 0:
+        console.print("[red]⚠️ --rate cannot be negative.[/red]")
+        sys.exit(1)
+    for name in ('connections', 'max_connections', 'retries'):
+        if getattr(args, name) is not None and getattr(args, name) < 1:
+            console.print(f"[red]⚠️ --{name.replace('_', '-')} must be at least 1.[/red]")
+            sys.exit(1)
+    if args.lease < 3:
+        console.print("[red]⚠️ --lease must be at least 3 seconds.[/red]")
+        sys.exit(1)
+    if args.enqueue_to and not (args.url or args.batch_file):
+        console.print("[red]⚠️ --enqueue-to needs --url or --batch-file.[/red]")
+        sys.exit(1)
+    # How each MP3 is processed; queued items carry these to the workers that download them
+    media_options = {'passthrough': args.passthrough, 'normalize': args.normalize, 'tags': args.tags}
     if args.gui:
         gui_main()
-    elif args.url:
+    elif args.serve:
+        serve_main(args.listen, args.jobs or int(load_config().get('serve_jobs', load_settings()[2])))
+    elif args.enqueue_to:
+        # Workers read the output directory from the queue, so store it as an absolute path
+        options = dict(media_options, type=args.type, quality=args.quality, output=normalize_output_path(args.output, args.type))
+        enqueue_media(args.enqueue_to, read_batch_urls(args.batch_file) if args.batch_file else [args.url], args.playlist, options)
+    elif args.batch_file or args.url or args.work_from:
         output_path = normalize_output_path(args.output, args.type)
-        asyncio.run(download_media(args.url, args.playlist, output_path, download_type=args.type, quality=args.quality))
+        metrics = RunMetrics()
+        # Settings shared by all three kinds of run; the media options come from the queue for --work-from
+        run_options = {
+            'jobs': args.jobs, 'engine': args.engine, 'sync': args.sync, 'refresh': args.refresh, 'transcode_jobs': args.transcode_jobs,
+            'connections': args.connections, 'max_connections': args.max_connections, 'chunk_size': args.chunk_size,
+            'range_downloader': args.range_downloader, 'rate': args.rate, 'retries': args.retries, 'store': not args.no_store,
+            'min_free_space': args.min_free_space, 'metrics': metrics,
+        }
+        if args.work_from:
+            run = lambda: asyncio.run(work_from_queue(args.work_from, args.worker_id, args.lease, output_path=output_path if args.output else None, **run_options))
+        elif args.batch_file:
+            batch = {'batch_urls': read_batch_urls(args.batch_file), 'report_path': args.report or 'batch_report.jsonl'}
+            run = lambda: asyncio.run(download_media(None, args.playlist, output_path, args.type, args.quality, **run_options, **media_options, **batch))
+        else:
+            single = {'stream': not args.no_stream, 'report_path': args.report}
+            run = lambda: asyncio.run(download_media(args.url, args.playlist, output_path, args.type, args.quality, **run_options, **media_options, **single))
+        try:
+            run_profiled(run, args.profile) if args.profile else run()
+        finally:
+            export_metrics(metrics, args.metrics_file, args.metrics_json)
     else:
         asyncio.run(cli_menu())
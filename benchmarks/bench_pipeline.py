@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from media_server import start_media_server
+
+# Offline throughput benchmark for download_media.
+#
+# Each scenario runs in a fresh child process and temp directory, so config.ini, the download
+# index and the metadata cache start empty and peak RSS belongs to that scenario alone. Videos
+# are synthetic info dicts whose formats point at the local media server, passed straight into
+# download_media(entries=...). That exercises the scheduler, the in-process/subprocess engines,
+# progress handling and (with --type mp3) the transcode stage without touching YouTube.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(BENCH_DIR), 'YT-Downloader.py')
+
+
+def load_downloader():
+    spec = importlib.util.spec_from_file_location('yt_downloader', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Lazily build fake info dicts, one format each, served by the local media server
+def fake_entries(base_url, count, size, latency, download_type):
+    ext = 'wav' if download_type == 'mp3' else 'mp4'
+    for i in range(count):
+        video_id = f"bench{i:05d}"
+        fmt = {
+            # What yt-dlp's generic extractor calls a direct file, so the subprocess engine's
+            # --format matches when it extracts the URL again
+            'format_id': ext,
+            'url': f"{base_url}/media/{video_id}.{ext}?size={size}&latency={latency}",
+            'ext': ext,
+            'protocol': 'http',
+            'filesize': size,
+        }
+        if ext == 'wav':
+            fmt.update({'acodec': 'pcm_s16le', 'vcodec': 'none', 'abr': 1411})
+        else:
+            fmt.update({'acodec': 'aac', 'vcodec': 'h264', 'height': 360})
+        yield {
+            'id': video_id,
+            'title': f"Bench Item {i:05d}",
+            # The subprocess engine hands this URL to a fresh yt-dlp, which fetches the file directly
+            'webpage_url': fmt['url'],
+            'extractor': 'bench',
+            'extractor_key': 'Bench',
+            'formats': [fmt],
+        }
+
+
+def peak_rss_mib():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# Time a plain HTTP fetch of one item, the floor that per-item overhead is measured against
+def calibrate_fetch(base_url, size, latency, ext, rounds=3):
+    timings = []
+    for i in range(rounds):
+        started = time.monotonic()
+        with urllib.request.urlopen(f"{base_url}/media/calibrate{i}.{ext}?size={size}&latency={latency}") as response:
+            while response.read(1 << 16):
+                pass
+        timings.append(time.monotonic() - started)
+    return min(timings)
+
+
+def run_scenario(args):
+    with tempfile.TemporaryDirectory(prefix='ytd-bench-') as workdir:
+        os.chdir(workdir)
+        with open('config.ini', 'w') as f:
+            # The local media server doesn't throttle, and the default rate limit would cap items/s
+            f.write("[Settings]\ncookies_browser=none\nrequests_per_second=0\n")
+        ytd = load_downloader()
+        ytd.console.quiet = True
+        server, base_url = start_media_server()
+        ext = 'wav' if args.type == 'mp3' else 'mp4'
+        fetch_time = calibrate_fetch(base_url, args.item_size, args.latency, ext)
+
+        tracker = ytd.ProgressTracker()
+        started = time.monotonic()
+        results = asyncio.run(ytd.download_media(
+            None, True, os.path.join(workdir, 'out'), args.type, 'best',
+            jobs=args.jobs, engine=args.engine, transcode_jobs=args.transcode_jobs,
+            tracker=tracker, dashboard=False,
+            entries=fake_entries(base_url, args.items, args.item_size, args.latency, args.type),
+        ))
+        wall = time.monotonic() - started
+        server.shutdown()
+        os.chdir(BENCH_DIR)
+
+    results = results or []
+    succeeded = [result for result in results if result['success']]
+    total_bytes = sum(result.get('bytes', 0) for result in succeeded)
+    slots = min(args.jobs, max(args.items, 1))
+    return {
+        'items': args.items,
+        'jobs': args.jobs,
+        'engine': args.engine,
+        'type': args.type,
+        'item_size': args.item_size,
+        'latency_ms': args.latency,
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'wall_seconds': round(wall, 3),
+        'items_per_second': round(len(succeeded) / wall, 2) if wall else None,
+        'mb_per_second': round(total_bytes / wall / 1e6, 2) if wall else None,
+        'time_to_first_byte': round(tracker.first_byte_at - started, 3) if tracker.first_byte_at else None,
+        'fetch_seconds': round(fetch_time, 4),
+        'per_item_overhead_ms': round((wall * slots / max(args.items, 1) - fetch_time) * 1000, 2),
+        'peak_rss_mib': peak_rss_mib(),
+    }
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline download_media throughput benchmark")
+    parser.add_argument('--sizes', type=parse_list, default=[1, 10, 100, 1000, 10000], help="Comma-separated playlist sizes")
+    parser.add_argument('--jobs', type=parse_list, default=[1, 4, 8], help="Comma-separated concurrency levels")
+    parser.add_argument('--engine', choices=['inprocess', 'subprocess'], default='inprocess')
+    parser.add_argument('--type', choices=['mp3', 'video'], default='video', help="mp3 also exercises the ffmpeg transcode stage")
+    parser.add_argument('--item-size', type=int, default=256 * 1024, help="Bytes per synthetic media file")
+    parser.add_argument('--latency', type=float, default=20, help="Server time-to-first-byte per request, in ms")
+    parser.add_argument('--transcode-jobs', type=int, default=None)
+    parser.add_argument('--output', default=None, help="Write JSON results here instead of stdout")
+    parser.add_argument('--scenario', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--items', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        args.jobs = args.jobs[0]
+        print(json.dumps(run_scenario(args)))
+        return
+
+    scenarios = []
+    for items in args.sizes:
+        for jobs in args.jobs:
+            command = [
+                sys.executable, os.path.abspath(__file__), '--scenario',
+                '--items', str(items), '--jobs', str(jobs), '--engine', args.engine, '--type', args.type,
+                '--item-size', str(args.item_size), '--latency', str(args.latency),
+            ]
+            if args.transcode_jobs:
+                command.extend(['--transcode-jobs', str(args.transcode_jobs)])
+            completed = subprocess.run(command, capture_output=True, text=True, cwd=BENCH_DIR)
+            if completed.returncode != 0:
+                scenarios.append({'items': items, 'jobs': jobs, 'error': completed.stderr.strip().splitlines()[-1:]})
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            scenarios.append(result)
+            print(f"items={items:>5} jobs={jobs:>2}  {result['items_per_second']:>8} items/s  {result['mb_per_second']:>7} MB/s  "
+                  f"ttfb={result['time_to_first_byte']}s  overhead={result['per_item_overhead_ms']}ms  rss={result['peak_rss_mib']}MiB", file=sys.stderr)
+
+    report = {
+        'benchmark': 'pipeline',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scenarios': scenarios,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
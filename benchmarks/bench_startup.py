@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Startup-time benchmark for YT-Downloader.py.
+#
+# Times complete short-lived invocations (interpreter start, imports, dependency checks, argument
+# handling and exit) in a temp directory, so config.ini and the dependency cache start out as
+# they would on a user's machine. "cold" runs delete .deps_cache.json before every launch, so
+# they pay for the find_spec/which probing; "warm" runs reuse the fingerprint from the last launch.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(BENCH_DIR), 'YT-Downloader.py')
+
+SCENARIOS = {
+    'python': ['-c', 'pass'],
+    'help': [SCRIPT, '--help'],
+    'empty-batch': [SCRIPT, '--batch-file', 'empty.txt', '--non-interactive'],
+}
+
+
+def time_runs(command, rounds, workdir, cold):
+    timings = []
+    returncode = 0
+    for _ in range(rounds):
+        if cold and os.path.exists(os.path.join(workdir, '.deps_cache.json')):
+            os.remove(os.path.join(workdir, '.deps_cache.json'))
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, *command], cwd=workdir, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+        returncode = returncode or completed.returncode
+    return {
+        'min_ms': round(min(timings) * 1000, 1),
+        'median_ms': round(statistics.median(timings) * 1000, 1),
+        'max_ms': round(max(timings) * 1000, 1),
+        'returncode': returncode,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YT-Downloader.py startup-time benchmark")
+    parser.add_argument('--rounds', type=int, default=10, help="Launches per scenario")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated subset of: " + ', '.join(SCENARIOS))
+    parser.add_argument('--output', default=None, help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ytd-startup-') as workdir:
+        with open(os.path.join(workdir, 'config.ini'), 'w') as f:
+            f.write("[Settings]\ncookies_browser=none\n")
+        open(os.path.join(workdir, 'empty.txt'), 'w').close()
+        for name in args.scenarios.split(','):
+            for cold in (True, False) if name == 'empty-batch' else (False,):
+                result = {'scenario': name, 'deps_cache': 'cold' if cold else 'warm', **time_runs(SCENARIOS[name], args.rounds, workdir, cold)}
+                results.append(result)
+                print(f"{name:<12} {result['deps_cache']:<5} min={result['min_ms']}ms median={result['median_ms']}ms max={result['max_ms']}ms", file=sys.stderr)
+
+    report = {
+        'benchmark': 'startup',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'rounds': args.rounds,
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import struct
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Local stand-in for a media CDN. Every path under /media/ serves synthetic bytes:
+#   /media/<name>.<ext>?size=<bytes>&latency=<ms>
+# `latency` delays the response headers (time-to-first-byte); `.wav` files get a valid
+# PCM header so ffmpeg can decode them in transcode benchmarks. Range requests are honoured.
+
+CHUNK = bytes(range(256)) * 256  # 64 KiB repeating pattern
+
+
+# Build a 44-byte WAV header for `size` bytes of 16-bit stereo 44.1 kHz PCM
+def wav_header(size):
+    data_size = max(size - 44, 0)
+    return b'RIFF' + struct.pack('<I', data_size + 36) + b'WAVEfmt ' + struct.pack('<IHHIIHH', 16, 1, 2, 44100, 44100 * 4, 4, 16) + b'data' + struct.pack('<I', data_size)
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if not parts.path.startswith('/media/'):
+            self.send_error(404)
+            return
+        query = parse_qs(parts.query)
+        size = int(query.get('size', ['1048576'])[0])
+        latency = float(query.get('latency', ['0'])[0]) / 1000
+        header = wav_header(size) if parts.path.endswith('.wav') else b''
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        if range_header and range_header.startswith('bytes='):
+            first, _, last = range_header[6:].partition('-')
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+        if latency:
+            time.sleep(latency)
+        self.send_response(206 if range_header else 200)
+        self.send_header('Content-Type', 'audio/wav' if header else 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if range_header:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        position = start
+        while position <= end:
+            if position < len(header):
+                block = header[position:min(end + 1, len(header))]
+            else:
+                offset = (position - len(header)) % len(CHUNK)
+                block = CHUNK[offset:offset + min(len(CHUNK) - offset, end + 1 - position)]
+            try:
+                self.wfile.write(block)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            position += len(block)
+
+
+# Start the server on a background thread; returns (server, base_url)
+def start_media_server(host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), MediaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    server, base_url = start_media_server(port=8765)
+    print(f"Serving synthetic media at {base_url}/media/<name>.<ext>?size=<bytes>&latency=<ms>")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()